@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from mpi4py import MPI
+
+GB = 1024**3
+
+
+class Aggregator(object):
+    ''' Periodically reduce every rank's latest sample onto rank 0, which
+    writes a single time aligned timeline for the whole job.
+
+    Available memory is a per node quantity, so it is only gathered from
+    one leader rank per node (split by `COMM_TYPE_SHARED`), process tree
+    RSS is reduced over all ranks. Each period's collectives are posted
+    non-blocking and completed at the start of the next period, so a slow
+    node delays the timeline by at most one period instead of stalling
+    every rank's sampling.
+    '''
+    fields = ['time', 'nodes', 'ranks', 'finished',
+              'available_min', 'available_max', 'available_mean', 'available_sum',
+              'available_min_node',
+              'proc_rss_min', 'proc_rss_max', 'proc_rss_mean', 'proc_rss_sum']
+
+    def __init__(self, sampler, period=1.0, warn=0.05, comm=MPI.COMM_WORLD):
+        self.sampler = sampler
+        self.period = period
+        self.warn = warn
+        self.comm = comm
+        self.node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.rank)
+        leader = self.node.rank == 0
+        self.leaders = comm.Split(0 if leader else MPI.UNDEFINED, key=comm.rank)
+        self.hostnames = None
+        if leader:
+            self.hostnames = self.leaders.gather(MPI.Get_processor_name(), root=0)
+        self.nodes = comm.bcast(self.leaders.size if leader else None, root=0)
+
+    def latest(self, local_done):
+        row = self.sampler.last or {}
+        available = [row.get('available', np.nan), row.get('total', np.nan)]
+        local = [row.get('proc_rss', np.nan), float(local_done)]
+        return np.array(available, dtype=float), np.array(local, dtype=float)
+
+    def post(self, now, local_done):
+        ''' Start this period's reductions, returning everything that has
+        to stay alive until they complete
+        '''
+        available, local = self.latest(local_done)
+        pending = {'time': now, 'available': available, 'local': local, 'requests': []}
+        requests = pending['requests']
+
+        pending['done'] = np.zeros(1)
+        requests.append(self.comm.Iallreduce(local[1:], pending['done'], op=MPI.SUM))
+        for name, op in [('min', MPI.MIN), ('max', MPI.MAX), ('sum', MPI.SUM)]:
+            pending[name] = np.zeros(1)
+            requests.append(self.comm.Ireduce(local[:1], pending[name], op=op, root=0))
+        if self.leaders != MPI.COMM_NULL:
+            pending['nodes'] = np.zeros((self.nodes, 2)) if self.comm.rank == 0 else None
+            requests.append(self.leaders.Igather(available, pending['nodes'], root=0))
+        return pending
+
+    def complete(self, pending, log):
+        MPI.Request.Waitall(pending['requests'])
+        if self.comm.rank == 0:
+            available, total = pending['nodes'].T
+            worst = int(np.nanargmin(available)) if not np.all(np.isnan(available)) else -1
+            ranks = self.comm.size
+            log.write([pending['time'], self.nodes, ranks, pending['done'][0],
+                       np.nanmin(available), np.nanmax(available), np.nanmean(available),
+                       np.nansum(available), worst,
+                       pending['min'][0], pending['max'][0], pending['sum'][0]/ranks, pending['sum'][0]])
+            if worst >= 0 and available[worst] < self.warn*total[worst]:
+                print(f'Warning: node {self.hostnames[worst]} has only '
+                      f'{available[worst]/GB:.2f} of {total[worst]/GB:.2f} GB available',
+                      flush=True)
+        return int(pending['done'][0])
+
+    def run(self, finished, log=None):
+        ''' Aggregate until every rank's target has `finished`, only rank 0
+        needs a `log`
+        '''
+        self.comm.Barrier()
+        start = time.time()
+        pending = None
+        tick = 0
+        while True:
+            tick += 1
+            time.sleep(max(0, start + tick*self.period - time.time()))
+            if pending is not None and self.complete(pending, log) == self.comm.size:
+                break
+            pending = self.post(time.time() - start, finished())
+
+    def write_hostnames(self, filename):
+        if self.comm.rank == 0:
+            with open(filename, 'w') as fh:
+                fh.write('\n'.join(self.hostnames) + '\n')
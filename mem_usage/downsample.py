@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class Buckets(object):
+    ''' Running min, max and mean of a time series over fixed time buckets.
+
+    Chunks of a time ordered series are folded in one at a time, so the
+    memory used only depends on the number of buckets, never on the length
+    of the series.
+    '''
+    def __init__(self, start, stop, buckets=2000):
+        self.edges = np.linspace(start, stop, buckets + 1)
+        self.min = np.full(buckets, np.nan)
+        self.max = np.full(buckets, np.nan)
+        # When in each bucket the min and max were seen
+        self.min_time = np.full(buckets, np.nan)
+        self.max_time = np.full(buckets, np.nan)
+        self.sum = np.zeros(buckets)
+        self.count = np.zeros(buckets, dtype=np.int64)
+
+    @property
+    def centres(self):
+        return (self.edges[1:] + self.edges[:-1])/2
+
+    @property
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.sum/self.count, np.nan)
+
+    def add(self, t, y):
+        keep = ~np.isnan(y)
+        t, y = t[keep], y[keep]
+        if len(t) == 0:
+            return
+        idx = np.clip(np.searchsorted(self.edges, t, side='right') - 1, 0, len(self.count) - 1)
+        # Time is sorted, so each bucket is a contiguous run of the chunk
+        starts = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+        ids = idx[starts]
+        run = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(y)]))
+        position = np.arange(len(y))
+        for extreme, value, when, better in [(np.minimum, self.min, self.min_time, np.less),
+                                             (np.maximum, self.max, self.max_time, np.greater)]:
+            chunk = extreme.reduceat(y, starts)
+            # First sample of each run reaching its extreme
+            first = np.minimum.reduceat(np.where(y == chunk[run], position, len(y)), starts)
+            update = np.isnan(value[ids]) | better(chunk, value[ids])
+            value[ids[update]] = chunk[update]
+            when[ids[update]] = t[first[update]]
+        self.sum[ids] += np.add.reduceat(y, starts)
+        self.count[ids] += np.diff(np.r_[starts, len(y)])
+
+    def minmax(self):
+        ''' Min and max of every non-empty bucket at the times they were
+        seen, in time order, so the series keeps its spikes at pixel
+        resolution without the line doubling back
+        '''
+        full = self.count > 0
+        t = np.column_stack((self.min_time[full], self.max_time[full]))
+        y = np.column_stack((self.min[full], self.max[full]))
+        order = np.argsort(t, axis=1, kind='stable')
+        return np.take_along_axis(t, order, axis=1).ravel(), np.take_along_axis(y, order, axis=1).ravel()
+
+
+def lttb(x, y, n):
+    ''' Largest-Triangle-Three-Buckets downsampling of (x, y) to n points
+    '''
+    if n >= len(x) or n < 3:
+        return x, y
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, len(x) - 1
+    edges = np.linspace(1, len(x) - 1, n - 1).astype(np.int64)
+    a = 0
+    for ii in range(n - 2):
+        lo, hi = edges[ii], max(edges[ii + 1], edges[ii] + 1)
+        # Average of the next bucket is the third corner of the triangle
+        nlo, nhi = edges[ii + 1], edges[ii + 2] if ii + 2 < len(edges) else len(x)
+        cx = x[nlo:max(nhi, nlo + 1)].mean()
+        cy = y[nlo:max(nhi, nlo + 1)].mean()
+        area = np.abs((x[a] - cx)*(y[lo:hi] - y[a]) - (x[a] - x[lo:hi])*(cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[ii + 1] = a
+    return x[out], y[out]
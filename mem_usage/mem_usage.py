@@ -2,22 +2,60 @@ import os
 import sys
 import time
 
-from argparse import ArgumentParser
-from csv import DictWriter
+from argparse import ArgumentParser, REMAINDER
 from pathlib import Path
 
+# Options shared by every mode that records a log
+log_parser = ArgumentParser(add_help=False)
+log_parser.add_argument('--output', type=str, help='Name to save log to')
+log_parser.add_argument('--refresh', type=int, default=10, help='Samples between rescans for new child processes')
+log_parser.add_argument('--interval', type=float, default=0.1, help='Sampling interval (s) while memory is steady')
+log_parser.add_argument('--min_interval', type=float, default=None, help='Shortest sampling interval (s) while memory is changing, e.g. 0.001')
+log_parser.add_argument('--threshold', type=float, default=1, help='Change (MiB) between samples that counts as memory changing')
+log_parser.add_argument('--max_overhead', type=float, default=0.01, help='Maximum fraction of one core the sampler may use, a sample takes 0.1-1ms so 1ms sampling needs 0.1 or more')
+log_parser.add_argument('--format', type=str, choices=['csv', 'binary'], default='csv', help='Log file format')
+log_parser.add_argument('--capacity', type=int, default=2**18, help='Records held in the binary ring buffer')
+log_parser.add_argument('--flush_every', type=int, default=4096, help='Records between flushes of the binary log')
+
 parser = ArgumentParser()
 subparsers = parser.add_subparsers(dest='command')
-mon_parser = subparsers.add_parser('monitor')
+mon_parser = subparsers.add_parser('monitor', parents=[log_parser])
 mon_parser.add_argument('--target', type=str, help='Name of target application')
 mon_parser.add_argument('--timeout', type=int, default=10, help='Time to wait for application to start')
 mon_parser.add_argument('--free', action='store_true', help='Monitor remaining memory')
-mon_parser.add_argument('--output', type=str, help='Name to save log to')
+mon_parser.add_argument('--processes', action='store_true', help='Also log RSS, PSS, USS and swap of each target and its children')
+mon_parser.add_argument('--aggregate', type=float, default=None, help='Period (s) to reduce all ranks onto a single cluster log written by rank 0')
+mon_parser.add_argument('--warn', type=float, default=0.05, help='Warn when a node\'s available memory drops below this fraction of its total')
+run_parser = subparsers.add_parser('run', parents=[log_parser])
+run_parser.add_argument('cmd', nargs=REMAINDER, help='Command to launch and monitor, after `--`')
+# Rescan for forked children on every sample
+run_parser.set_defaults(refresh=1)
 plot_parser = subparsers.add_parser('plot')
-plot_parser.add_argument('--input', type=str, nargs='+', help='CSV to read')
+plot_parser.add_argument('--input', type=str, nargs='+', help='CSV or binary log to read')
 plot_parser.add_argument('--output', type=str, help='Name to save plot to')
+plot_parser.add_argument('--column', type=str, default='available', help='Column to plot')
+plot_parser.add_argument('--mode', type=str, choices=['separate', 'overlay', 'envelope'], default='separate',
+                         help='One figure per input, all inputs on one axis, or min/median/max across inputs')
+plot_parser.add_argument('--method', type=str, choices=['minmax', 'lttb'], default='minmax', help='Downsampling method')
+plot_parser.add_argument('--points', type=int, default=2000, help='Points (time buckets) per series')
+plot_parser.add_argument('--chunksize', type=int, default=2**16, help='Records read at a time')
+sum_parser = subparsers.add_parser('summarize')
+sum_parser.add_argument('--input', type=str, nargs='+', required=True, help='CSV or binary logs, one per rank')
+sum_parser.add_argument('--output', type=str, default='summary.json', help='Name to save JSON report to')
+sum_parser.add_argument('--threshold', type=str, nargs='*', default=['0.9'],
+                        help='Used memory to report time above, as a size (64G) or fraction of total (0.9)')
+sum_parser.add_argument('--limit', type=str, default=None, help='Exit with status 1 if peak used memory exceeds this size or fraction')
+sum_parser.add_argument('--phases', type=int, default=3, help='Number of phases to segment each rank into')
+sum_parser.add_argument('--points', type=int, default=512, help='Time buckets used for phase segmentation')
+sum_parser.add_argument('--ranks_per_node', type=int, default=1, help='Ranks per node, assuming block placement')
+sum_parser.add_argument('--chunksize', type=int, default=2**16, help='Records read at a time')
+conv_parser = subparsers.add_parser('convert')
+conv_parser.add_argument('--input', type=str, nargs='+', required=True, help='Binary log to convert')
+conv_parser.add_argument('--output', type=str, nargs='+', help='Name to save CSV to')
 args, unknown = parser.parse_known_args()
 
+SUFFIX = {'csv': '.csv', 'binary': '.memlog'}
+
 def monitor(args):
     import psutil
     try:
@@ -39,54 +77,250 @@ def monitor(args):
     else:
         raise ProcessLookupError(f'Target application did not start within {args.timeout} seconds of this script launching')
 
-    mem = psutil.virtual_memory()._asdict()
+    def finished():
+        return not all(p.is_running() for p in process)
+
+    def wait(sampler):
+        if args.aggregate:
+            cluster(args, sampler, finished)
+        else:
+            while not finished():
+                time.sleep(0.1)
+
+    pids = [p.pid for p in process] if args.processes else []
+    record(args, rank, pids, wait)
+
+def cluster(args, sampler, finished):
+    from aggregate import Aggregator
+    from memlog import open_log
+
+    aggregator = Aggregator(sampler, period=args.aggregate, warn=args.warn)
+    log = None
+    if aggregator.comm.rank == 0:
+        name = args.output if args.output else f'free_{int(time.time())}'
+        aggregator.write_hostnames(f'{name}_cluster_nodes.txt')
+        kwargs = {'capacity': args.capacity, 'flush_every': args.flush_every} if args.format == 'binary' else {}
+        log = open_log(f'{name}_cluster{SUFFIX[args.format]}', args.format, Aggregator.fields, **kwargs)
+    try:
+        aggregator.run(finished, log)
+    finally:
+        if log is not None:
+            log.close()
+
+def launch(args):
+    import signal
+    from subprocess import Popen
+
+    cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+    if not cmd:
+        raise ValueError('No command given to run, usage: mem_usage.py run [options] -- <cmd>')
+
+    # Importing mpi4py here would initialise MPI in the monitor, so take
+    # the rank from the launcher's environment instead
+    for var in ['OMPI_COMM_WORLD_RANK', 'PMI_RANK', 'PMIX_RANK', 'SLURM_PROCID']:
+        if var in os.environ:
+            rank = int(os.environ[var])
+            break
+    else:
+        rank = 0
+
+    children = []
+
+    def start():
+        children.append(Popen(cmd))
+        return [children[0].pid]
+
+    def forward(signum, frame):
+        for child in children:
+            child.send_signal(signum)
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, forward)
+
+    record(args, rank, start, lambda sampler: children[0].wait())
+    returncode = children[0].wait()
+    # Report death by signal the same way a shell would
+    return 128 - returncode if returncode < 0 else returncode
+
+def record(args, rank, pids, wait):
+    from memlog import open_log
+    from procfs import ProcessTree
+    from sampler import MemInfo, Sampler
+
+    # A function starting the processes is only called now the imports,
+    # numpy among them, are done, so sampling starts right behind them
+    if callable(pids):
+        pids = pids()
+
+    trees = {pid: ProcessTree(pid, refresh=args.refresh) for pid in pids}
+    proc_fields = []
+    if trees:
+        proc_fields += [f'proc_{k}' for k in ProcessTree.fields]
+        proc_fields += [f'proc_{k}_{pid}' for pid in trees for k in ProcessTree.fields]
+
+    suffix = SUFFIX[args.format]
     if args.output:
-        outfile = f'{args.output}_{rank}.csv'
+        outfile = f'{args.output}_{rank}{suffix}'
     else:
-        outfile = f'free{rank}_{int(time.time())}.csv'
-    with open(outfile, 'w') as fh:
-        start = time.time()
-        csv = DictWriter(fh, ['time'] + [k for k in mem.keys()])
-        csv.writeheader()
-        while all(p.is_running() for p in process):
-            row = psutil.virtual_memory()._asdict()
-            row['time'] = time.time() - start
-            csv.writerow(row)
-            fh.flush()
-            time.sleep(0.1)
+        outfile = f'free{rank}_{int(time.time())}{suffix}'
+    fields = ['time'] + MemInfo.fields + proc_fields
+    kwargs = {'capacity': args.capacity, 'flush_every': args.flush_every} if args.format == 'binary' else {}
+    log = open_log(outfile, args.format, fields, **kwargs)
+    sampler = Sampler(log, fields, trees,
+                      min_interval=args.min_interval or args.interval,
+                      max_interval=args.interval,
+                      threshold=args.threshold*2**20,
+                      max_overhead=args.max_overhead)
+    sampler.start()
+    try:
+        wait(sampler)
+    finally:
+        sampler.stop()
+        sampler.join()
+        print(sampler.report())
+        log.close()
+        for tree in trees.values():
+            tree.close()
+
+def bucket_log(filename, column, start, stop, args, points=None):
+    from downsample import Buckets
+    from memlog import iter_log
+
+    if points is None:
+        # Extra buckets give LTTB something to choose from
+        points = args.points*(4 if args.method == 'lttb' else 1)
+    buckets = Buckets(start, stop, points)
+    for chunk in iter_log(filename, ['time', column], chunksize=args.chunksize):
+        buckets.add(chunk['time'], chunk[column])
+    return buckets
+
+def downsampled(buckets, args):
+    from downsample import lttb
+
+    t, y = buckets.minmax()
+    if args.method == 'lttb':
+        t, y = lttb(t, y, args.points)
+    return t, y
 
 def plot(args):
     import matplotlib.pyplot as plt
-    from pandas import read_csv
+    import numpy as np
+    import warnings
+    from memlog import log_fields, log_span
 
     if args.input is None:
-        infile = [sorted(filter(lambda x: x.startswith('free') and x.endswith('.csv'), os.listdir()))[-1]]
+        suffixes = tuple(SUFFIX.values())
+        infile = [sorted(filter(lambda x: x.startswith('free') and x.endswith(suffixes), os.listdir()))[-1]]
     else:
         infile = args.input
 
-    for ii, csv in enumerate(infile):
-        data = read_csv(csv)
-        data['available (GB)'] = data['available']/(1024**3)
-
-        fig, ax = plt.subplots(1, 1)
-        fig.set_size_inches(8, 6)
-        data.plot('time', 'available (GB)', ax=ax)
+    column = args.column
+    spans = [log_span(f) for f in infile]
+    total = 0
+    for f in infile:
+        if 'total' in log_fields(f):
+            total = max(total, log_span(f, 'total')[0])
+    ylabel = 'Free Memory (GB)' if column == 'available' else f'{column} (GB)'
 
+    def finish(fig, ax, outfile):
         ax.set_xlabel('Time (s)')
-        ax.set_ylim(0, data['total'][0]/(1024**3))
-        ax.set_ylabel('Free Memory (GB)')
-
-        if args.output:
-            outfile = Path(args.output)
-            if len(infile) > 1:
-                outfile = outfile.with_stem(outfile.stem + f'_{ii}')
-            fig.savefig(outfile)
-        else:
-            fig.savefig(Path(csv).with_suffix('.png'))
+        if total and column.startswith('available'):
+            ax.set_ylim(0, total/(1024**3))
+        ax.set_ylabel(ylabel)
+        ax.legend()
+        fig.savefig(outfile)
+        plt.close(fig)
+
+    if args.mode == 'separate':
+        for ii, (csv, span) in enumerate(zip(infile, spans)):
+            t, y = downsampled(bucket_log(csv, column, *span, args), args)
+
+            fig, ax = plt.subplots(1, 1)
+            fig.set_size_inches(8, 6)
+            ax.plot(t, y/(1024**3), label=f'{column} (GB)')
+
+            if args.output:
+                outfile = Path(args.output)
+                if len(infile) > 1:
+                    outfile = outfile.with_stem(outfile.stem + f'_{ii}')
+            else:
+                outfile = Path(csv).with_suffix('.png')
+            finish(fig, ax, outfile)
+        return
+
+    # Every input is binned onto the same time axis
+    start = np.nanmin([s[0] for s in spans])
+    stop = np.nanmax([s[1] for s in spans])
+    fig, ax = plt.subplots(1, 1)
+    fig.set_size_inches(8, 6)
+    if args.mode == 'overlay':
+        for csv in infile:
+            t, y = downsampled(bucket_log(csv, column, start, stop, args), args)
+            ax.plot(t, y/(1024**3), label=Path(csv).stem, lw=0.8)
+    else:
+        means = np.empty((len(infile), args.points))
+        lows = np.empty_like(means)
+        highs = np.empty_like(means)
+        for ii, csv in enumerate(infile):
+            buckets = bucket_log(csv, column, start, stop, args, points=args.points)
+            means[ii], lows[ii], highs[ii] = buckets.mean, buckets.min, buckets.max
+        t = buckets.centres
+        # Buckets no input covers are all NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low = np.nanmin(lows, axis=0)
+            median = np.nanmedian(means, axis=0)
+            high = np.nanmax(highs, axis=0)
+        ax.fill_between(t, low/(1024**3), high/(1024**3), alpha=0.3, label=f'min/max of {len(infile)} logs')
+        ax.plot(t, median/(1024**3), label='median')
+
+    outfile = Path(args.output) if args.output else Path(infile[0]).with_suffix(f'.{args.mode}.png')
+    finish(fig, ax, outfile)
+
+def summarize(args):
+    import json
+    from summary import size2val, summarize_logs
+
+    thresholds = [size2val(t) for t in args.threshold]
+    report = summarize_logs(args.input, thresholds,
+                            points=args.points,
+                            phases=args.phases,
+                            ranks_per_node=args.ranks_per_node,
+                            chunksize=args.chunksize)
+    status = 0
+    if args.limit:
+        limit = size2val(args.limit)
+        if limit <= 1:
+            total = max(r['total'] for r in report['ranks'])
+            limit *= total
+        report['limit'] = limit
+        report['passed'] = report['peak_used'] <= limit
+        status = 0 if report['passed'] else 1
+    with open(args.output, 'w') as fh:
+        json.dump(report, fh, indent=2)
+    print(f'Peak used memory {report["peak_used"]/(1024**3):.3f} GB on rank '
+          f'{report["peak_used_rank"]} at {report["peak_used_time"]:.2f}s')
+    return status
+
+def convert(args):
+    from memlog import to_csv
+
+    if args.output:
+        assert len(args.output) == len(args.input), 'Need one output name per input'
+        outfiles = args.output
+    else:
+        outfiles = [Path(f).with_suffix('.csv') for f in args.input]
+    for infile, outfile in zip(args.input, outfiles):
+        to_csv(infile, outfile)
 
 if __name__ == '__main__':
     if args.command == 'monitor':
         monitor(args)
+    elif args.command == 'run':
+        sys.exit(launch(args))
     elif args.command == 'plot':
         plot(args)
+    elif args.command == 'summarize':
+        sys.exit(summarize(args))
+    elif args.command == 'convert':
+        convert(args)
 
@@ -0,0 +1,187 @@
+import json
+import mmap
+import os
+
+import numpy as np
+
+from csv import writer as csv_writer
+
+MAGIC = b'MEMLOG01'
+# Header: magic, uint64 record count, then a JSON description of the
+# fields padded out to a single page
+HEADER = 4096
+COUNT_OFFSET = len(MAGIC)
+JSON_OFFSET = COUNT_OFFSET + 8
+DTYPE = np.dtype('<f8')
+
+
+class CSVLog(object):
+    ''' Plain text log, one row per sample flushed straight away
+    '''
+    def __init__(self, filename, fields):
+        self.fields = list(fields)
+        self.fh = open(filename, 'w', newline='')
+        self.csv = csv_writer(self.fh)
+        self.csv.writerow(self.fields)
+
+    def write(self, values):
+        self.csv.writerow(values)
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+class RingLog(object):
+    ''' Binary log of fixed width float64 records in a preallocated, memory
+    mapped ring buffer.
+
+    Records are written straight into the mapping and the mapping is only
+    synced to disk every `flush_every` records, so the filesystem sees a
+    few large writes instead of one small write per sample. Once
+    `capacity` records have been written the oldest are overwritten.
+    '''
+    def __init__(self, filename, fields, capacity=2**18, flush_every=4096):
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.count = 0
+
+        meta = json.dumps({'fields': self.fields, 'capacity': capacity}).encode()
+        if JSON_OFFSET + len(meta) > HEADER:
+            raise ValueError(f'Too many fields ({len(self.fields)}) to fit in log header')
+
+        self.fh = open(filename, 'w+b')
+        self.fh.truncate(HEADER + capacity*len(self.fields)*DTYPE.itemsize)
+        self.mm = mmap.mmap(self.fh.fileno(), 0)
+        self.mm[:len(MAGIC)] = MAGIC
+        self.mm[JSON_OFFSET:JSON_OFFSET + len(meta)] = meta
+        self.counter = np.ndarray((1,), dtype='<u8', buffer=self.mm, offset=COUNT_OFFSET)
+        self.data = np.ndarray((capacity, len(self.fields)), dtype=DTYPE, buffer=self.mm, offset=HEADER)
+
+    def write(self, values):
+        self.data[self.count % self.capacity] = values
+        self.count += 1
+        self.counter[0] = self.count
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.flush()
+        del self.counter, self.data
+        self.mm.close()
+        self.fh.close()
+        self.mm = None
+
+
+def open_log(logname, fmt, fields, **kwargs):
+    if fmt == 'binary':
+        return RingLog(logname, fields, **kwargs)
+    return CSVLog(logname, fields)
+
+
+def is_binary(filename):
+    with open(filename, 'rb') as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def read_header(filename):
+    ''' Field names, capacity and records written of a binary log, from its
+    header page alone
+    '''
+    with open(filename, 'rb') as fh:
+        header = fh.read(HEADER)
+    if header[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{filename} is not a binary memory log')
+    count = int(np.frombuffer(header, dtype='<u8', count=1, offset=COUNT_OFFSET)[0])
+    meta = json.loads(header[JSON_OFFSET:].rstrip(b'\0'))
+    return meta['fields'], meta['capacity'], count
+
+
+def read_binary(filename):
+    ''' Memory map a binary log, returning the field names and a
+    (records, fields) array in time order.
+
+    The array is a read only view onto the file unless the ring buffer has
+    wrapped around, in which case it is rotated into a copy.
+    '''
+    fields, capacity, count = read_header(filename)
+    data = np.memmap(filename, dtype=DTYPE, mode='r', offset=HEADER, shape=(capacity, len(fields)))
+    if count <= capacity:
+        data = data[:count]
+    else:
+        start = count % capacity
+        data = np.concatenate((data[start:], data[:start]))
+    return fields, data
+
+
+def read_log(filename):
+    ''' Dictionary of column name to 1D array for either log format
+    '''
+    if is_binary(filename):
+        fields, data = read_binary(filename)
+        return {f: data[:, ii] for ii, f in enumerate(fields)}
+    from pandas import read_csv
+    frame = read_csv(filename)
+    return {f: frame[f].to_numpy() for f in frame.columns}
+
+
+def to_csv(filename, outfile):
+    ''' Convert a binary log to the CSV layout written by `monitor`
+    '''
+    fields, data = read_binary(filename)
+    with open(outfile, 'w', newline='') as fh:
+        fh.write(','.join(fields) + '\n')
+        np.savetxt(fh, data, fmt='%.15g', delimiter=',')
+
+
+def log_fields(filename):
+    if is_binary(filename):
+        return read_header(filename)[0]
+    with open(filename, 'r') as fh:
+        return fh.readline().strip().split(',')
+
+
+def log_span(filename, column='time'):
+    ''' First and last value of `column` without reading the whole log
+    '''
+    if is_binary(filename):
+        fields, capacity, count = read_header(filename)
+        if count == 0:
+            return np.nan, np.nan
+        # Only the oldest and newest slots of the ring are touched, a wrapped
+        # ring starts at the slot that is overwritten next
+        data = np.memmap(filename, dtype=DTYPE, mode='r', offset=HEADER, shape=(capacity, len(fields)))
+        ii = fields.index(column)
+        return float(data[count % capacity if count > capacity else 0, ii]), float(data[(count - 1) % capacity, ii])
+    with open(filename, 'rb') as fh:
+        fields = fh.readline().decode().strip().split(',')
+        first = fh.readline()
+        fh.seek(0, os.SEEK_END)
+        fh.seek(max(0, fh.tell() - 65536))
+        last = fh.read().rstrip(b'\n').rsplit(b'\n', 1)[-1]
+    if not first:
+        return np.nan, np.nan
+    ii = fields.index(column)
+    return float(first.split(b',')[ii]), float(last.split(b',')[ii])
+
+
+def iter_log(filename, columns, chunksize=2**16):
+    ''' Stream `columns` of a log as dictionaries of 1D arrays holding at
+    most `chunksize` records, binary logs are yielded as views of the file
+    '''
+    if is_binary(filename):
+        fields, data = read_binary(filename)
+        index = [fields.index(c) for c in columns]
+        for start in range(0, len(data), chunksize):
+            chunk = data[start:start + chunksize]
+            yield {c: chunk[:, ii] for c, ii in zip(columns, index)}
+    else:
+        from pandas import read_csv
+        for frame in read_csv(filename, usecols=columns, chunksize=chunksize):
+            yield {c: frame[c].to_numpy() for c in columns}
@@ -0,0 +1,147 @@
+import os
+
+PAGESIZE = os.sysconf('SC_PAGE_SIZE')
+KIB = 1024
+
+
+class ProcFile(object):
+    ''' A file in /proc that is kept open and re-read from the start on
+    every call, avoiding a path lookup and open/close per sample
+    '''
+    def __init__(self, path, bufsize=4096):
+        self.path = path
+        self.bufsize = bufsize
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        return os.pread(self.fd, self.bufsize, 0)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def children(pid):
+    ''' Direct children of `pid`, collected over all of its threads
+    '''
+    kids = []
+    try:
+        tasks = os.listdir(f'/proc/{pid}/task')
+    except (FileNotFoundError, ProcessLookupError):
+        return kids
+    for tid in tasks:
+        try:
+            with open(f'/proc/{pid}/task/{tid}/children', 'rb') as fh:
+                kids += [int(k) for k in fh.read().split()]
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+    return kids
+
+
+def descendants(pid):
+    ''' All descendants of `pid`, falling back to psutil when the kernel
+    does not provide /proc/<pid>/task/<tid>/children
+    '''
+    # Probed on this process, an exited target has no children file either
+    if not os.path.exists(f'/proc/self/task/{os.getpid()}/children'):
+        import psutil
+        try:
+            return [c.pid for c in psutil.Process(pid).children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+    found = []
+    stack = [pid]
+    while stack:
+        kids = children(stack.pop())
+        found += kids
+        stack += kids
+    return found
+
+
+class ProcessMemory(object):
+    ''' RSS, PSS, USS and swap (in bytes) of a single process, read from
+    /proc/<pid>/statm and /proc/<pid>/smaps_rollup
+    '''
+    fields = ['rss', 'pss', 'uss', 'swap']
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.statm = ProcFile(f'/proc/{pid}/statm')
+        try:
+            self.smaps = ProcFile(f'/proc/{pid}/smaps_rollup')
+        except (FileNotFoundError, PermissionError):
+            # Kernels before 4.14 or processes owned by another user
+            self.smaps = None
+
+    def sample(self):
+        mem = dict.fromkeys(self.fields, 0)
+        mem['rss'] = int(self.statm.read().split()[1])*PAGESIZE
+        if self.smaps is not None:
+            for line in self.smaps.read().split(b'\n'):
+                key, _, value = line.partition(b':')
+                if key == b'Pss':
+                    mem['pss'] = int(value.split()[0])*KIB
+                elif key in (b'Private_Clean', b'Private_Dirty'):
+                    mem['uss'] += int(value.split()[0])*KIB
+                elif key == b'Swap':
+                    mem['swap'] = int(value.split()[0])*KIB
+        else:
+            mem['pss'] = mem['uss'] = mem['swap'] = float('nan')
+        return mem
+
+    def close(self):
+        self.statm.close()
+        if self.smaps is not None:
+            self.smaps.close()
+
+
+class ProcessTree(object):
+    ''' Memory usage of a process summed with all of its descendants.
+
+    The set of descendants is only rescanned every `refresh` samples, the
+    /proc files of known processes are kept open between samples.
+    '''
+    fields = ProcessMemory.fields
+
+    def __init__(self, pid, refresh=10):
+        self.pid = pid
+        self.refresh = refresh
+        self._count = 0
+        self._procs = {}
+        self.update()
+
+    def update(self):
+        pids = {self.pid, *descendants(self.pid)}
+        for pid in set(self._procs) - pids:
+            self._procs.pop(pid).close()
+        for pid in pids - set(self._procs):
+            try:
+                self._procs[pid] = ProcessMemory(pid)
+            except (FileNotFoundError, ProcessLookupError):
+                pass
+
+    def pids(self):
+        return sorted(self._procs)
+
+    def sample(self):
+        if self._count % self.refresh == 0:
+            self.update()
+        self._count += 1
+
+        total = dict.fromkeys(self.fields, 0)
+        for pid, proc in list(self._procs.items()):
+            try:
+                mem = proc.sample()
+            except (OSError, IndexError, ValueError):
+                # Process exited since the last rescan
+                self._procs.pop(pid).close()
+                continue
+            for k in self.fields:
+                total[k] += mem[k]
+        return total
+
+    def close(self):
+        for proc in self._procs.values():
+            proc.close()
+        self._procs = {}
@@ -0,0 +1,152 @@
+import threading
+import time
+
+from procfs import KIB, ProcFile
+
+
+def sample_trees(trees):
+    ''' Per target and summed process tree memory as log columns
+    '''
+    row = {}
+    for pid, tree in trees.items():
+        for k, v in tree.sample().items():
+            row[f'proc_{k}_{pid}'] = v
+            row[f'proc_{k}'] = row.get(f'proc_{k}', 0) + v
+    return row
+
+
+class MemInfo(object):
+    ''' System memory read straight from /proc/meminfo, with the same
+    fields and definitions as `psutil.virtual_memory()` on Linux
+    '''
+    fields = ['total', 'available', 'percent', 'used', 'free', 'active',
+              'inactive', 'buffers', 'cached', 'shared', 'slab']
+
+    def __init__(self):
+        self.meminfo = ProcFile('/proc/meminfo', bufsize=8192)
+
+    def sample(self):
+        raw = {}
+        for line in self.meminfo.read().split(b'\n'):
+            key, _, value = line.partition(b':')
+            if value:
+                raw[key] = int(value.split()[0])*KIB
+        mem = {
+            'total': raw[b'MemTotal'],
+            'free': raw[b'MemFree'],
+            'active': raw[b'Active'],
+            'inactive': raw[b'Inactive'],
+            'buffers': raw[b'Buffers'],
+            'cached': raw[b'Cached'] + raw.get(b'SReclaimable', 0),
+            'shared': raw.get(b'Shmem', 0),
+            'slab': raw.get(b'Slab', 0)
+        }
+        mem['available'] = raw.get(b'MemAvailable', mem['free'] + mem['buffers'] + mem['cached'])
+        # As current psutil does, older versions subtracted free, buffers
+        # and cache instead
+        mem['used'] = mem['total'] - mem['available']
+        mem['percent'] = round(100*(mem['total'] - mem['available'])/mem['total'], 1)
+        return {k: mem[k] for k in self.fields}
+
+    def close(self):
+        self.meminfo.close()
+
+
+class Sampler(threading.Thread):
+    ''' Background thread sampling system and process tree memory into a log.
+
+    The interval drops to `min_interval` whenever a watched value moves by
+    more than `threshold` bytes between samples and backs off towards
+    `max_interval` while memory is steady. Independently of
+    that, each sample waits until the thread's total CPU time is back under
+    `max_overhead` of the elapsed time, so the cap holds over the whole run.
+    A sample costs from about 100 us to a millisecond when there are many
+    processes to rescan, so sampling every millisecond needs `max_overhead`
+    of 0.1 or more; `report` gives the cap the measured cost calls for when
+    throttling kept `min_interval` out of reach.
+    '''
+    def __init__(self, log, fields, trees=None, min_interval=0.1,
+                 max_interval=0.1, threshold=2**20, max_overhead=0.01,
+                 watch=('available', 'proc_rss')):
+        super().__init__(daemon=True)
+        self.log = log
+        self.fields = fields
+        self.trees = trees if trees is not None else {}
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.max_overhead = max_overhead
+        self.watch = [w for w in watch if w in fields]
+        self.meminfo = MemInfo()
+        self._stop_event = threading.Event()
+
+        self.last = None
+        self.cost = 0
+        self.samples = 0
+        self.cpu_time = 0
+        self.wall_time = 0
+        self.fastest = max_interval
+        self.throttled = 0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def row(self, start):
+        row = self.meminfo.sample()
+        row['time'] = time.time() - start
+        if self.trees:
+            row.update(sample_trees(self.trees))
+        return row
+
+    def run(self):
+        start = time.time()
+        cpu_start = time.thread_time()
+        interval = self.max_interval
+        cost = 0
+        last = None
+        try:
+            while not self._stop_event.is_set():
+                t = time.thread_time()
+                row = self.row(start)
+                self.log.write([row.get(f, float('nan')) for f in self.fields])
+                t = time.thread_time() - t
+                cost = t if self.samples == 0 else 0.9*cost + 0.1*t
+                self.samples += 1
+
+                if last is not None:
+                    if any(abs(row[w] - last[w]) > self.threshold for w in self.watch):
+                        interval = self.min_interval
+                    else:
+                        interval = min(self.max_interval, interval*1.25)
+                last = self.last = row
+
+                # Hard cap on overhead, no sooner than the recent cost of a
+                # sample allows nor before the CPU time used so far is back
+                # under the cap of the time elapsed
+                used = time.thread_time() - cpu_start
+                wait = max(cost/self.max_overhead, start + used/self.max_overhead - time.time())
+                if wait > interval:
+                    interval = wait
+                    self.throttled += 1
+                self.fastest = min(self.fastest, interval)
+                self.cost = cost
+                self._stop_event.wait(interval)
+        finally:
+            self.cpu_time = time.thread_time() - cpu_start
+            self.wall_time = time.time() - start
+            self.meminfo.close()
+
+    def report(self):
+        overhead = self.cpu_time/self.wall_time if self.wall_time else 0
+        rate = self.samples/self.wall_time if self.wall_time else 0
+        report = (f'Sampler: {self.samples} samples in {self.wall_time:.3f}s '
+                  f'(mean {rate:.1f} Hz, fastest interval {1000*self.fastest:.3g}ms), '
+                  f'CPU time {self.cpu_time:.3f}s = {100*overhead:.3g}% of one core '
+                  f'(cap {100*self.max_overhead:.3g}%, throttled {self.throttled} times)')
+        if self.throttled and self.cost/self.max_overhead > self.min_interval:
+            report += (f'\n  a sample costs {1e6*self.cost:.3g}us, an interval of {1000*self.min_interval:.3g}ms '
+                       f'needs --max_overhead {self.cost/self.min_interval:.2g}')
+        if self.samples == 1:
+            # The first sample is taken whatever it costs
+            report += '\n  only the initial sample was taken, the cap applies from the second'
+        return report
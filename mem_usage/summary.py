@@ -0,0 +1,215 @@
+import re
+
+import numpy as np
+
+from downsample import Buckets
+from memlog import iter_log, log_fields, log_span
+from pathlib import Path
+
+
+def size2val(size):
+    ''' Bytes from a size such as 512M or 64G, or a fraction of total memory
+    when the value is no more than 1
+    '''
+    suffix = ['', 'k', 'm', 'g', 't']
+    if size[-1].lower() in suffix[1:]:
+        return float(size[:-1])*2**(10*suffix.index(size[-1].lower()))
+    return float(size)
+
+
+def log_rank(filename, default):
+    ''' Rank written into a log name by the monitor, `free<rank>_<time>` or
+    `<output>_<rank>` where the output name may hold digits of its own, or
+    `default` for logs of a single process such as `free_<time>`
+    '''
+    name = Path(filename).name
+    match = re.fullmatch(r'free(\d+)_\d+\.(?:csv|memlog)', name)
+    if match is None and not re.fullmatch(r'free_\d+\.(?:csv|memlog)', name):
+        match = re.search(r'_(\d+)\.(?:csv|memlog)$', name)
+    return int(match.group(1)) if match else default
+
+
+class Watermark(object):
+    ''' Exact peak and time spent at or above thresholds of a series, folded
+    in chunk by chunk
+    '''
+    def __init__(self, thresholds):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.peak = -np.inf
+        self.peak_time = np.nan
+        self.above = np.zeros(len(self.thresholds))
+        self._last = None
+
+    def add(self, t, y, total=None):
+        if self._last is not None:
+            t = np.r_[self._last[0], t]
+            y = np.r_[self._last[1], y]
+            if total is not None:
+                total = np.r_[self._last[2], total]
+        if len(t) == 0:
+            return
+        if not np.all(np.isnan(y)):
+            ii = np.nanargmax(y)
+            if y[ii] > self.peak:
+                self.peak, self.peak_time = y[ii], t[ii]
+        # Each sample holds until the next one
+        thresholds = self.thresholds[None, :]
+        if total is not None:
+            thresholds = np.where(thresholds <= 1, thresholds*total[:-1, None], thresholds)
+        self.above += ((y[:-1, None] >= thresholds)*np.diff(t)[:, None]).sum(axis=0)
+        self._last = (t[-1:], y[-1:], None if total is None else total[-1:])
+
+
+def segment(series, phases):
+    ''' Optimal split of every row of `series` into `phases` piecewise
+    constant segments, by dynamic programming over the segment ends
+    vectorised across rows. Returns the (rows, phases + 1) segment bounds.
+
+    Empty (NaN) buckets, such as those outside a log that covers less time
+    than the others, count for nothing in the cost, and a segment of only
+    empty buckets is not allowed unless a row has too few values to fill
+    every phase. Breakpoints are then spent on real changes only.
+    '''
+    rows, n = series.shape
+    valid = ~np.isnan(series)
+    y = np.where(valid, series - np.nanmean(series, axis=1, keepdims=True), 0)
+    s0, s1, s2 = (np.concatenate((np.zeros((rows, 1)), np.cumsum(v, axis=1)), axis=1)
+                  for v in (valid.astype(float), y, y**2))
+    sparse = (valid.sum(axis=1) < phases)[:, None]
+
+    def cost(i, j):
+        # Sum of squared error of the values in y[:, i:j] about their mean,
+        # i is an array
+        count = s0[:, [j]] - s0[:, i]
+        total = s1[:, [j]] - s1[:, i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sse = s2[:, [j]] - s2[:, i] - total**2/count
+        return np.where(count > 0, sse, np.where(sparse, 0, np.inf))
+
+    best = np.full((phases + 1, rows, n + 1), np.inf)
+    best[0, :, 0] = 0
+    split = np.zeros((phases + 1, rows, n + 1), dtype=np.int64)
+    for k in range(1, phases + 1):
+        for j in range(k, n + 1):
+            i = np.arange(k - 1, j)
+            candidates = best[k - 1][:, i] + cost(i, j)
+            choice = np.argmin(candidates, axis=1)
+            best[k, :, j] = candidates[np.arange(rows), choice]
+            split[k, :, j] = i[choice]
+
+    bounds = np.zeros((rows, phases + 1), dtype=np.int64)
+    bounds[:, -1] = n
+    for k in range(phases, 0, -1):
+        bounds[:, k - 1] = split[k, np.arange(rows), bounds[:, k]]
+    return bounds
+
+
+def describe_phases(t, series, bounds, tolerance=0.05):
+    ''' Label each segment relative to the highest one: segments within
+    `tolerance` of its level are steady, those before it ramp-up and those
+    after it teardown
+    '''
+    segments = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        present = lo + np.flatnonzero(~np.isnan(series[lo:hi]))
+        if len(present) > 0:
+            # Segments run from their first to last bucket holding data
+            segments.append((present[0], present[-1] + 1, series[present]))
+    if not segments:
+        return []
+    means = np.array([np.mean(v) for _, _, v in segments])
+    top = int(np.argmax(means))
+    scale = np.nanmax(series) - np.nanmin(series)
+
+    phases = []
+    for ii, (lo, hi, valid) in enumerate(segments):
+        if abs(means[ii] - means[top]) <= tolerance*scale:
+            name = 'steady'
+        elif ii < top:
+            name = 'ramp-up'
+        else:
+            name = 'teardown'
+        phases.append({'phase': name,
+                       'start': float(t[lo]),
+                       'end': float(t[hi - 1]),
+                       'mean': float(means[ii]),
+                       'min': float(np.min(valid)),
+                       'max': float(np.max(valid))})
+    return phases
+
+
+def summarize_logs(infiles, thresholds=(), points=512, phases=3,
+                   ranks_per_node=1, chunksize=2**16):
+    ''' Summary of a set of rank logs as a JSON serialisable dictionary.
+
+    Each log is streamed once, accumulating exact peaks and time above
+    thresholds of used memory (total - available) and process RSS, while
+    the series used for phase segmentation is binned onto a common time
+    grid. Segmentation and the per node reduction then run over all ranks
+    at once.
+    '''
+    spans = np.array([log_span(f) for f in infiles])
+    start, stop = np.nanmin(spans[:, 0]), np.nanmax(spans[:, 1])
+    ranks = []
+    series = np.full((len(infiles), points), np.nan)
+    for ii, filename in enumerate(infiles):
+        fields = log_fields(filename)
+        has_rss = 'proc_rss' in fields
+        columns = ['time', 'total', 'available'] + (['proc_rss'] if has_rss else [])
+        used = Watermark(thresholds)
+        rss = Watermark([])
+        buckets = Buckets(start, stop, points)
+        for chunk in iter_log(filename, columns, chunksize=chunksize):
+            node_used = chunk['total'] - chunk['available']
+            used.add(chunk['time'], node_used, chunk['total'])
+            if has_rss:
+                rss.add(chunk['time'], chunk['proc_rss'])
+            buckets.add(chunk['time'], chunk['proc_rss'] if has_rss else node_used)
+        series[ii] = buckets.mean
+        ranks.append({'rank': log_rank(filename, ii),
+                      'file': str(filename),
+                      'start': float(spans[ii, 0]),
+                      'end': float(spans[ii, 1]),
+                      'total': float(log_span(filename, 'total')[0]),
+                      'peak_used': float(used.peak),
+                      'peak_used_time': float(used.peak_time),
+                      'peak_proc_rss': float(rss.peak) if has_rss else None,
+                      'peak_proc_rss_time': float(rss.peak_time) if has_rss else None,
+                      'time_above': {str(k): float(v) for k, v in zip(thresholds, used.above)},
+                      'phase_series': 'proc_rss' if has_rss else 'used'})
+
+    t = Buckets(start, stop, points).centres
+    bounds = segment(series, phases)
+    for rank, row, bound in zip(ranks, series, bounds):
+        rank['phases'] = describe_phases(t, row, bound)
+
+    # Ranks are assumed to be placed on nodes in contiguous blocks
+    order = np.argsort([r['rank'] for r in ranks], kind='stable')
+    node_of = np.array([ranks[ii]['rank'] for ii in order])//ranks_per_node
+    peak_used = np.array([ranks[ii]['peak_used'] for ii in order])
+    starts = np.flatnonzero(np.r_[True, node_of[1:] != node_of[:-1]])
+    node_peak = np.maximum.reduceat(peak_used, starts)
+    has_rss = all(r['phase_series'] == 'proc_rss' for r in ranks)
+    # Summed at bucket resolution, so a lower bound on the true peak
+    node_rss = np.add.reduceat(np.nan_to_num(series[order]), starts, axis=0)
+    nodes = []
+    for jj, (lo, peak) in enumerate(zip(starts, node_peak)):
+        hi = starts[jj + 1] if jj + 1 < len(starts) else len(order)
+        members = [ranks[ii] for ii in order[lo:hi]]
+        worst = max(members, key=lambda r: r['peak_used'])
+        nodes.append({'node': int(node_of[lo]),
+                      'ranks': [r['rank'] for r in members],
+                      'peak_used': float(peak),
+                      'peak_used_time': worst['peak_used_time'],
+                      'peak_proc_rss_sum': float(np.max(node_rss[jj])) if has_rss else None,
+                      'time_above': {k: max(r['time_above'][k] for r in members) for k in worst['time_above']}})
+
+    worst = max(ranks, key=lambda r: r['peak_used'])
+    return {'inputs': len(infiles),
+            'thresholds': [float(x) for x in thresholds],
+            'points': points,
+            'peak_used': worst['peak_used'],
+            'peak_used_rank': worst['rank'],
+            'peak_used_time': worst['peak_used_time'],
+            'ranks': ranks,
+            'nodes': nodes}
@@ -0,0 +1,31 @@
+from summary import log_rank
+
+
+def test_log_rank_output_name():
+    assert log_rank('job_5.csv', -1) == 5
+    assert log_rank('job_2_5.csv', -1) == 5
+    assert log_rank('run_2024_17.memlog', -1) == 17
+
+
+def test_log_rank_free():
+    assert log_rank('free3_1700000000.csv', -1) == 3
+    assert log_rank('logs/free12_1700000000.memlog', -1) == 12
+    assert log_rank('free_1700000000.csv', -1) == -1
+    assert log_rank('notes.txt', 7) == 7
+
+
+def test_segment_unequal_lengths():
+    import numpy as np
+    from summary import describe_phases, segment
+
+    t = np.arange(64, dtype=float)
+    # Ramp-up, steady and teardown over the whole span
+    full = np.r_[np.full(16, 1.0), np.full(32, 5.0), np.full(16, 2.0)]
+    # The same shape in a log covering only the first half of the span
+    short = np.r_[np.full(8, 1.0), np.full(16, 5.0), np.full(8, 2.0), np.full(32, np.nan)]
+    bounds = segment(np.vstack((full, short)), 3)
+    assert list(bounds[0]) == [0, 16, 48, 64]
+    phases = describe_phases(t, short, bounds[1])
+    assert [p['phase'] for p in phases] == ['ramp-up', 'steady', 'teardown']
+    assert [p['start'] for p in phases] == [0, 8, 24]
+    assert phases[-1]['end'] == 31
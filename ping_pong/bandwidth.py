@@ -0,0 +1,172 @@
+import numpy as np
+
+from argparse import ArgumentParser
+from fitting import log_sizes, size2val
+from mpi4py import MPI
+from pathlib import Path
+from pickle import dump
+from schedule import partner, schedule
+
+comm = MPI.COMM_WORLD
+size = comm.size
+rank = comm.rank
+
+assert size != 1, 'Running in serial, no bandwidth results'
+
+# Parse command line arguments
+parser = ArgumentParser()
+parser.add_argument('-o', '--output', default='bandwidth.pickle')
+parser.add_argument('-m', '--mode', choices=['bidir', 'streams', 'injection', 'bisection'], default='bidir',
+                    help='Bidirectional pairs, k streams per pair, all ranks of a node off-node at once, or across a split of the job')
+parser.add_argument('-r', '--repeats', type=int, default=20, help='Timed iterations per message size')
+parser.add_argument('--warmup', type=int, default=2, help='Untimed iterations per message size')
+parser.add_argument('-k', '--window', type=int, default=16, help='Concurrent messages per pair in streams mode')
+parser.add_argument('--min_size', type=str, default='1', help='Smallest message size in bytes')
+parser.add_argument('--max_size', type=str, default='4M', help='Largest message size in bytes')
+parser.add_argument('--sizes', type=int, default=12, help='Number of log spaced message sizes')
+parser.add_argument('--split', type=str, default=None, help='Comma separated ranks on one side of the bisection, random if not given')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the random bisection')
+args, _ = parser.parse_known_args()
+
+sizes = log_sizes(size2val(args.min_size), size2val(args.max_size), args.sizes)
+# Every message of a streams window gets its own slice of the buffers
+largest = sizes[-1]*(args.window if args.mode == 'streams' else 1)
+send = np.random.Generator(np.random.PCG64(rank)).integers(256, size=largest, dtype=np.uint8)
+recv = np.zeros(largest, dtype=np.uint8)
+
+
+def exchange(other, count, repeats):
+    ''' Simultaneous send and receive of `count` bytes with `other`,
+    returning the time for `repeats` exchanges
+    '''
+    t = MPI.Wtime()
+    for _ in range(repeats):
+        requests = [comm.Irecv([recv, count, MPI.BYTE], source=other, tag=1),
+                    comm.Isend([send, count, MPI.BYTE], dest=other, tag=1)]
+        MPI.Request.Waitall(requests)
+    return MPI.Wtime() - t
+
+
+def stream(ping, pong, count, window, repeats):
+    ''' `window` messages of `count` bytes in flight from ping to pong at
+    once, acknowledged by a single byte, returning the time for `repeats`
+    windows on ping
+    '''
+    ack = np.zeros(1, dtype=np.uint8)
+    t = MPI.Wtime()
+    for _ in range(repeats):
+        if rank == ping:
+            requests = [comm.Isend([send[ii*count:], count, MPI.BYTE], dest=pong, tag=ii) for ii in range(window)]
+            MPI.Request.Waitall(requests)
+            comm.Recv([ack, 1, MPI.BYTE], source=pong, tag=window)
+        else:
+            requests = [comm.Irecv([recv[ii*count:], count, MPI.BYTE], source=ping, tag=ii) for ii in range(window)]
+            MPI.Request.Waitall(requests)
+            comm.Send([ack, 1, MPI.BYTE], dest=ping, tag=window)
+    return MPI.Wtime() - t
+
+
+def concurrent(partners):
+    ''' Every rank exchanges with its partner (or sits out if None) at the
+    same time, returning bits moved per second by each rank, for each size,
+    in bits/s like the ping pong rates
+    '''
+    other = partners[rank]
+    rates = []
+    for count in sizes:
+        if other is not None:
+            exchange(other, count, args.warmup)
+        comm.Barrier()
+        t = exchange(other, count, args.repeats) if other is not None else 0
+        # Everyone is bounded by the slowest exchange
+        t = comm.allreduce(t, op=MPI.MAX)
+        rates.append(2*8*count*args.repeats/t if other is not None else 0)
+    return np.array(rates)
+
+
+# Sizes are in bytes, rates in bits/s to match plot_times and the regimes
+results = {'mode': args.mode, 'sizes': sizes, 'units': 'bits/s'}
+
+if args.mode in ['bidir', 'streams']:
+    # Round robin rounds of disjoint pairs, all pairs of a round run together
+    pairs = {}
+    for round_pairs in schedule(size, 'roundrobin'):
+        mine = partner(round_pairs, rank)
+        rates = []
+        msg_rates = []
+        for count in sizes:
+            comm.Barrier()
+            if mine is None:
+                continue
+            ping, pong = mine
+            other = pong if rank == ping else ping
+            if args.mode == 'bidir':
+                exchange(other, count, args.warmup)
+                t = exchange(other, count, args.repeats)
+                # 8 bits to a byte in both directions
+                rates.append(2*8*count*args.repeats/t)
+            else:
+                stream(ping, pong, count, args.window, args.warmup)
+                t = stream(ping, pong, count, args.window, args.repeats)
+                rates.append(8*args.window*count*args.repeats/t)
+                msg_rates.append(args.window*args.repeats/t)
+        if mine is not None and rank == mine[0]:
+            pairs[mine] = {'rate': rates, 'message_rate': msg_rates} if args.mode == 'streams' else {'rate': rates}
+    gathered = comm.gather(pairs, root=0)
+    if rank == 0:
+        results['pairs'] = dict(sorted((k, v) for g in gathered for k, v in g.items()))
+        if args.mode == 'streams':
+            results['window'] = args.window
+
+elif args.mode == 'injection':
+    # Same local rank on neighbouring nodes, node 2i paired with node 2i + 1
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    leaders = comm.Split(0 if node.rank == 0 else MPI.UNDEFINED, key=rank)
+    node_id = node.bcast(leaders.rank if node.rank == 0 else None, root=0)
+    nodes = comm.allreduce(node_id, op=MPI.MAX) + 1
+    layout = comm.allgather((node_id, node.rank))
+    lookup = {nl: r for r, nl in enumerate(layout)}
+    if nodes < 2:
+        if rank == 0:
+            print('Injection bandwidth needs at least 2 nodes, only found 1')
+        partners = [None]*size
+    else:
+        partners = []
+        for n, local in layout:
+            buddy = n + 1 if n % 2 == 0 else n - 1
+            partners.append(lookup.get((buddy, local)))
+    rates = concurrent(partners)
+    # Off-node bits per second summed over the ranks of each node
+    node_rates = comm.gather((node_id, rates), root=0)
+    if rank == 0:
+        per_node = {}
+        for n, r in node_rates:
+            per_node[n] = per_node.get(n, 0) + r/2
+        results['nodes'] = {n: [float(x) for x in r] for n, r in sorted(per_node.items())}
+    hostnames = comm.gather((node_id, MPI.Get_processor_name()), root=0)
+    if rank == 0:
+        results['hostnames'] = dict(sorted(set(hostnames)))
+
+elif args.mode == 'bisection':
+    if args.split:
+        side = sorted(int(r) for r in args.split.split(','))
+    else:
+        side = sorted(np.random.Generator(np.random.PCG64(args.seed)).permutation(size)[:size//2])
+    other_side = sorted(set(range(size)) - set(side))
+    partners = [None]*size
+    for a, b in zip(side, other_side):
+        partners[a], partners[b] = b, a
+    rates = concurrent(partners)
+    # Every bit sent by one side crosses the cut
+    total = comm.reduce(rates/2, op=MPI.SUM, root=0)
+    if rank == 0:
+        results['split'] = [int(r) for r in side]
+        results['pairs'] = min(len(side), len(other_side))
+        results['bisection'] = [float(x) for x in total]
+
+if rank == 0:
+    if 'bisection' in results:
+        print('Bisection bandwidth', results['bisection'], 'bits/s')
+    outfile = Path(args.output).absolute()
+    with open(outfile, 'wb') as fh:
+        dump(results, fh)
@@ -0,0 +1,185 @@
+import numpy as np
+
+from argparse import ArgumentParser
+from fitting import log_sizes, size2val
+from mpi4py import MPI
+from pathlib import Path
+from pickle import dump
+
+comm = MPI.COMM_WORLD
+size = comm.size
+rank = comm.rank
+
+assert size != 1, 'Running in serial, no collective results'
+
+# Bus bandwidth correction for communicator size n, as in nccl-tests, so
+# that the numbers are comparable to the link speed whatever n is
+BUS_FACTOR = {'allreduce': lambda n: 2*(n - 1)/n,
+              'bcast': lambda n: 1,
+              'alltoall': lambda n: (n - 1)/n}
+
+# Parse command line arguments
+parser = ArgumentParser()
+parser.add_argument('-o', '--output', default='collectives.pickle')
+parser.add_argument('-c', '--collectives', nargs='+', choices=list(BUS_FACTOR), default=list(BUS_FACTOR))
+parser.add_argument('--comms', nargs='+', choices=['world', 'node', 'leaders', 'sub'], default=['world', 'node', 'leaders', 'sub'],
+                    help='Communicators to sweep: all ranks, ranks sharing a node, one rank per node, and blocks of ranks')
+parser.add_argument('--sub_sizes', type=int, nargs='+', default=None,
+                    help='Sizes of the sub-communicators of consecutive ranks, powers of 2 below the world size by default')
+parser.add_argument('-r', '--repeats', type=int, default=20, help='Timed iterations per message size')
+parser.add_argument('--warmup', type=int, default=2, help='Untimed iterations per message size')
+parser.add_argument('--min_size', type=str, default='8', help='Smallest message size in bytes per rank')
+parser.add_argument('--max_size', type=str, default='4M', help='Largest message size in bytes per rank')
+parser.add_argument('--sizes', type=int, default=12, help='Number of log spaced message sizes')
+parser.add_argument('--no_overlap', action='store_true', help='Skip the non-blocking overlap measurement')
+args, _ = parser.parse_known_args()
+
+sizes = log_sizes(size2val(args.min_size), size2val(args.max_size), args.sizes)
+largest = sizes[-1]
+
+
+def communicators():
+    ''' (name, communicator) for every communicator swept, MPI.COMM_NULL on
+    ranks outside it. Sub-communicators of the same size run concurrently.
+    '''
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    for name in args.comms:
+        if name == 'world':
+            yield name, comm
+        elif name == 'node':
+            yield name, node
+        elif name == 'leaders':
+            yield name, comm.Split(0 if node.rank == 0 else MPI.UNDEFINED, key=rank)
+        elif name == 'sub':
+            sub_sizes = args.sub_sizes or [2**ii for ii in range(1, int(np.log2(size - 1)) + 1)]
+            for n in sub_sizes:
+                if 1 < n < size:
+                    yield f'sub{n}', comm.Split(rank//n, key=rank)
+
+
+def buffers(name, sub, count):
+    ''' Send and receive buffers for `count` bytes per rank, allreduce works
+    on float64 and the rest on raw bytes
+    '''
+    if name == 'allreduce':
+        n = max(1, count//8)
+        return [send64[:n], n, MPI.DOUBLE], [recv64[:n], n, MPI.DOUBLE]
+    if name == 'alltoall':
+        n = max(1, count//sub.size)
+        return [send8, n, MPI.BYTE], [recv8, n, MPI.BYTE]
+    return [send8, count, MPI.BYTE], None
+
+
+def blocking(name, sub, send, recv):
+    if name == 'allreduce':
+        sub.Allreduce(send, recv, op=MPI.SUM)
+    elif name == 'bcast':
+        sub.Bcast(send, root=0)
+    elif name == 'alltoall':
+        sub.Alltoall(send, recv)
+
+
+def nonblocking(name, sub, send, recv):
+    if name == 'allreduce':
+        return sub.Iallreduce(send, recv, op=MPI.SUM)
+    elif name == 'bcast':
+        return sub.Ibcast(send, root=0)
+    elif name == 'alltoall':
+        return sub.Ialltoall(send, recv)
+
+
+def compute(seconds):
+    ''' Stand in for application work, busy for `seconds` without calling MPI
+    '''
+    t = MPI.Wtime()
+    while MPI.Wtime() - t < seconds:
+        pass
+
+
+def timed(sub, call, repeats):
+    ''' Per iteration time of `call` on `sub`, each the slowest rank's time
+    '''
+    times = np.zeros(repeats)
+    for ii in range(repeats):
+        sub.Barrier()
+        t = MPI.Wtime()
+        call()
+        times[ii] = MPI.Wtime() - t
+    sub.Allreduce(MPI.IN_PLACE, times, op=MPI.MAX)
+    return times
+
+
+def overlap(name, sub, send, recv, repeats):
+    ''' Fraction of the non-blocking collective hidden behind computation,
+    as in the OSU benchmarks: 1 - (overlapped - compute)/pure, where the
+    compute time matches the pure collective time
+    '''
+    pure = timed(sub, lambda: nonblocking(name, sub, send, recv).Wait(), repeats)
+    work = np.median(pure)
+
+    def overlapped():
+        request = nonblocking(name, sub, send, recv)
+        compute(work)
+        request.Wait()
+
+    total = timed(sub, overlapped, repeats)
+    return pure, total, float(np.clip(1 - (np.median(total) - work)/np.median(pure), 0, 1))
+
+
+send8 = np.random.Generator(np.random.PCG64(rank)).integers(256, size=largest, dtype=np.uint8)
+recv8 = np.zeros(largest, dtype=np.uint8)
+send64 = np.random.Generator(np.random.PCG64(rank)).random(max(1, largest//8))
+recv64 = np.zeros(max(1, largest//8))
+
+# Results
+local_results = {}
+
+for comm_name, sub in communicators():
+    member = sub != MPI.COMM_NULL
+    n = sub.size if member else 0
+    for name in args.collectives:
+        if rank == 0:
+            print(f'{name} on {comm_name}', flush=True)
+        for count in sizes:
+            times = np.zeros(args.repeats)
+            pure = np.zeros(args.repeats)
+            total = np.zeros(args.repeats)
+            ratio = 0.0
+            if member:
+                send, recv = buffers(name, sub, count)
+                for _ in range(args.warmup):
+                    blocking(name, sub, send, recv)
+                times = timed(sub, lambda: blocking(name, sub, send, recv), args.repeats)
+                if not args.no_overlap:
+                    pure, total, ratio = overlap(name, sub, send, recv, args.repeats)
+            # Concurrent sub-communicators are as slow as the slowest of them
+            comm.Allreduce(MPI.IN_PLACE, times, op=MPI.MAX)
+            comm.Allreduce(MPI.IN_PLACE, pure, op=MPI.MAX)
+            comm.Allreduce(MPI.IN_PLACE, total, op=MPI.MAX)
+            n = comm.allreduce(n, op=MPI.MAX)
+            ratio = comm.allreduce(ratio if member else 1.0, op=MPI.MIN)
+            if rank == 0:
+                median = float(np.median(times))
+                local_results[(name, comm_name, n, count)] = {
+                    'min': float(np.min(times)),
+                    'median': median,
+                    'max': float(np.max(times)),
+                    # Bits per second to match the ping pong rates
+                    'algbw': 8*count/median,
+                    'busbw': 8*count/median*BUS_FACTOR[name](n),
+                    'nonblocking': None if args.no_overlap else float(np.median(pure)),
+                    'overlapped': None if args.no_overlap else float(np.median(total)),
+                    'overlap': None if args.no_overlap else ratio}
+
+if rank==0:
+    latencies = []
+    rates = []
+    for key, res in local_results.items():
+        latencies.append(res['median'])
+        rates.append(res['busbw'])
+        print(key, f"{res['min']:.3e} {res['median']:.3e} {res['max']:.3e} s", f"{res['busbw']:.3e} bits/s")
+    outfile = Path(args.output).absolute()
+    with open(outfile, 'wb') as fh:
+        dump((latencies, rates), fh)
+    with open(outfile.with_suffix('.detailed.pickle'), 'wb') as fh:
+        dump((sizes, local_results), fh)
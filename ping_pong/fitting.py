@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def size2val(size):
+    ''' Bytes from a size such as 1, 512k or 256M
+    '''
+    suffix = ['', 'k', 'm', 'g']
+    if size[-1].lower() in suffix[1:]:
+        return int(float(size[:-1])*2**(10*suffix.index(size[-1].lower())))
+    return int(size)
+
+
+def log_sizes(smallest, largest, count):
+    ''' Unique, log spaced message sizes in bytes
+    '''
+    return [int(s) for s in np.unique(np.geomspace(smallest, largest, count).round())]
+
+
+def line_fit(x, y):
+    ''' Least squares line through (x, y) minimising the relative error,
+    returning slope, intercept and the weighted sum of squared residuals
+    '''
+    w = 1/y
+    A = np.column_stack((x*w, w))
+    (m, c), *_ = np.linalg.lstsq(A, np.ones_like(y), rcond=None)
+    residual = (m*x + c)*w - 1
+    return m, c, residual @ residual
+
+
+def line_fits(x, Y):
+    ''' The fit of `line_fit` for every column of `Y` against the same `x`
+    at once, returning arrays of slopes and intercepts
+    '''
+    W = 1/Y
+    # Scaled to at most 1 so the normal equations stay well conditioned
+    scale = np.max(np.abs(x))
+    A = (x/scale)[:, None]*W
+    aa, aw, ww, ra, rw = ((A*A).sum(axis=0), (A*W).sum(axis=0), (W*W).sum(axis=0),
+                          A.sum(axis=0), W.sum(axis=0))
+    det = aa*ww - aw**2
+    return (ww*ra - aw*rw)/det/scale, (aa*rw - aw*ra)/det
+
+
+def segment_fits(x, y, min_points=2):
+    ''' The fit of `line_fit` for every segment x[i:j] of at least
+    `min_points` points at once, from prefix sums of the weighted normal
+    equations. Returns (n + 1, n + 1) arrays of slope, intercept and sum of
+    squared residuals, with NaN and inf for segments too short to fit.
+    '''
+    n = len(x)
+    w = 1/y
+    # Scaled to at most 1 so the normal equations stay well conditioned
+    scale = np.max(np.abs(x))
+    a = x/scale*w
+    sums = [np.r_[0, np.cumsum(v)] for v in (a*a, a*w, w*w, a, w)]
+    i, j = np.triu_indices(n + 1, k=min_points)
+    aa, aw, ww, ra, rw = (s[j] - s[i] for s in sums)
+    det = aa*ww - aw**2
+    m = (ww*ra - aw*rw)/det
+    c = (aa*rw - aw*ra)/det
+    slope = np.full((n + 1, n + 1), np.nan)
+    intercept = np.full((n + 1, n + 1), np.nan)
+    sse = np.full((n + 1, n + 1), np.inf)
+    slope[i, j] = m/scale
+    intercept[i, j] = c
+    # Residual of the least squares solution, (j - i) - m*ra - c*rw
+    sse[i, j] = np.maximum((j - i) - m*ra - c*rw, 0)
+    return slope, intercept, sse
+
+
+def piecewise_fit(x, y, max_segments=4, min_points=3, penalty=None):
+    ''' Piecewise linear fit of sorted (x, y) with breakpoints found by
+    segmented least squares.
+
+    Every possible segment is fitted at once by `segment_fits`, then
+    dynamic programming finds
+    the best split into 1 to `max_segments` segments of at least
+    `min_points` points. The number of segments minimises a BIC style
+    n*log(SSE/n) + penalty*segments criterion. Segments are not forced to
+    meet, a protocol switch usually shows up as a jump in time.
+
+    Returns a list of (start index, stop index, slope, intercept).
+    '''
+    n = len(x)
+    if penalty is None:
+        penalty = 3*np.log(n)
+    max_segments = max(1, min(max_segments, n//min_points))
+
+    slope, intercept, cost = segment_fits(x, y, min_points=min_points)
+
+    best = np.full((max_segments + 1, n + 1), np.inf)
+    best[0, 0] = 0
+    split = np.zeros((max_segments + 1, n + 1), dtype=int)
+    for k in range(1, max_segments + 1):
+        for j in range(1, n + 1):
+            candidates = best[k - 1, :j] + cost[:j, j]
+            split[k, j] = np.argmin(candidates)
+            best[k, j] = candidates[split[k, j]]
+
+    with np.errstate(divide='ignore'):
+        score = [n*np.log(max(best[k, n], 1e-300)/n) + penalty*k for k in range(1, max_segments + 1)]
+    k = int(np.argmin(score)) + 1
+
+    bounds = [n]
+    for kk in range(k, 0, -1):
+        bounds.append(split[kk, bounds[-1]])
+    bounds = bounds[::-1]
+    return [(i, j, slope[i, j], intercept[i, j]) for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def regimes(sizes, times, max_segments=4, min_points=3):
+    ''' Latency and bandwidth regimes of one pair from per message size
+    timings, with the message sizes where the fit switches regime.
+
+    As elsewhere the x axis is bits transferred, 8 bits to a byte sent back
+    _and_ forth, so the rate is in bits/s and latency is a round trip.
+    '''
+    sizes = np.asarray(sizes)
+    x = 16*sizes.astype(float)
+    y = np.asarray(times, dtype=float)
+    segments = piecewise_fit(x, y, max_segments=max_segments, min_points=min_points)
+    out = []
+    for i, j, m, c in segments:
+        out.append({'smallest': int(sizes[i]),
+                    'largest': int(sizes[j - 1]),
+                    'latency': float(c),
+                    'rate': float(1/m) if m > 0 else float('inf'),
+                    'slope': float(m)})
+    breakpoints = [int(sizes[i]) for i, *_ in segments[1:]]
+    return {'breakpoints': breakpoints, 'regimes': out}
@@ -1,4 +1,5 @@
 #include <assert.h>
+#include <math.h>
 #include <stdio.h>
 #include <stdint.h>
 #include <stdlib.h>
@@ -6,10 +7,17 @@
 
 #define BLOCK 1024
 #define MAX_INT ( 1<<24 )
+/* 64 bit products so large messages do not overflow before the modulus */
+#define PING_TAG(bytes, rank, jj) ((int)((10*(int64_t)(bytes)*(rank) + (jj))%MAX_INT))
+#define PONG_TAG(bytes, rank, jj) ((int)((20*(int64_t)(bytes)*(rank) + (jj))%MAX_INT))
 
 int32_t *empty_buff(int size);
 void randomise(int32_t *buff, int size);
 double *pingpong(int ping, int pong, int *message_sizes, int mslen, int repeats);
+void pingpong_adaptive(int ping, int pong, int *message_sizes, int mslen,
+                       int min_repeats, int max_repeats, double rel_width,
+                       double time_budget, double *results, int *taken);
+double median_rel_width(double *sorted, int n);
 
 int main(int argc, char **argv){
     char processor_name[MPI_MAX_PROCESSOR_NAME];
@@ -23,6 +31,11 @@ int main(int argc, char **argv){
     double *results;
     int message_sizes[] = {1, 10, 20, 40, 70, 100};
 
+    /* Message sizes in bytes */
+    for(ii=0; ii<lens; ii++){
+        message_sizes[ii] *= BLOCK*sizeof(int32_t);
+    }
+
     /* Seed RNG */
     srandom(111);
     /* Initialize the MPI environment */
@@ -53,9 +66,6 @@ int main(int argc, char **argv){
             }
             printf("\n");
         }
-    }
-
-    if(world_size > 1){
         free(results);
     }
 
@@ -85,74 +95,149 @@ void randomise(int32_t *buff, int size){
     }
 }
 
+/* Fixed number of repeats of every message size, returning a results
+ * array on the ping rank that the caller must free (NULL on other ranks)
+ */
 double *pingpong(int ping, int pong, int *message_sizes, int mslen, int repeats){
-    int ii, jj;
-    int mesg_size, rank, size;
+    int rank;
+    double *results = NULL;
+
+    MPI_Comm_rank(MPI_COMM_WORLD, &rank);
+    if(rank == ping){
+        results = (double*)malloc(mslen*repeats*sizeof(double));
+        assert(("Unable to malloc", results != NULL));
+    }
+    pingpong_adaptive(ping, pong, message_sizes, mslen,
+                      repeats, repeats, 0, 0, results, NULL);
+    return results;
+}
+
+/* Relative width of the distribution free 95% confidence interval of the
+ * median of n sorted samples, from the binomial order statistics
+ */
+double median_rel_width(double *sorted, int n){
+    int lower, upper;
+    double median;
+
+    lower = (int)floor((n - 1.96*sqrt(n))/2) - 1;
+    upper = (int)ceil(1 + (n + 1.96*sqrt(n))/2) - 1;
+    if(lower < 0 || upper > n - 1){
+        return INFINITY;
+    }
+    median = (n % 2) ? sorted[n/2] : (sorted[n/2 - 1] + sorted[n/2])/2;
+    return (sorted[upper] - sorted[lower])/median;
+}
+
+/* Ping pong every message size between at least min_repeats and at most
+ * max_repeats times, stopping early once the confidence interval of the
+ * median is narrower than rel_width or the size has used its share of
+ * time_budget (seconds for the whole pair, 0 for no limit).
+ * Message sizes are in bytes.
+ * Samples for size ii are written to the caller allocated
+ * results[max_repeats*ii + jj] and the number taken to taken[ii] if not
+ * NULL, both only on the ping rank. Other ranks may pass NULL for both.
+ */
+void pingpong_adaptive(int ping, int pong, int *message_sizes, int mslen,
+                       int min_repeats, int max_repeats, double rel_width,
+                       double time_budget, double *results, int *taken){
+    int ii, jj, kk, tag;
+    int mesg_size, nelem, rank, size;
     int32_t *send, *recv;
     double t = 0;
-    double *results;
+    double start, sample;
+    double *sorted;
     MPI_Status status;
 
-    results = NULL;
-
     MPI_Comm_size(MPI_COMM_WORLD, &size);
     MPI_Comm_rank(MPI_COMM_WORLD, &rank);
 
 
     if(rank == ping){
-        // Results array
-        results = (double*)malloc(mslen*repeats*sizeof(double));
-        assert(("Unable to malloc", results != NULL));
+        assert(("No results array on ping rank", results != NULL));
+        sorted = (double*)malloc(max_repeats*sizeof(double));
+        assert(("Unable to malloc", sorted != NULL));
 
         for(ii=0; ii<mslen; ii++){
             // Malloc here
-            mesg_size = BLOCK*message_sizes[ii];
-            send = empty_buff(mesg_size);
-            recv = empty_buff(mesg_size);
-
-            for(jj=0; jj<repeats; jj++){
+            mesg_size = message_sizes[ii];
+            nelem = (mesg_size + sizeof(int32_t) - 1)/sizeof(int32_t);
+            send = empty_buff(nelem);
+            recv = empty_buff(nelem);
+            // Once per size, randomising hundreds of MiB every repeat is slow
+            randomise(send, nelem);
+            start = MPI_Wtime();
+
+            for(jj=0; jj<max_repeats; jj++){
                 // printf(".");
-                randomise(send, mesg_size);
                 t = MPI_Wtime();
                 MPI_Send(send,
                          mesg_size,
-                         MPI_INT32_T,
+                         MPI_BYTE,
                          pong,
-                         (10*mesg_size*ping + jj)%MAX_INT,
+                         PING_TAG(mesg_size, ping, jj),
                          MPI_COMM_WORLD);
-                // printf("!%d\n", (20*mesg_size*pong + jj)%MAX_INT);
+                // printf("!%d\n", PONG_TAG(mesg_size, pong, jj));
                 MPI_Recv(recv,
                          mesg_size,
-                         MPI_INT32_T,
+                         MPI_BYTE,
                          pong,
-                         (20*mesg_size*pong + jj)%MAX_INT,
+                         PONG_TAG(mesg_size, pong, jj),
                          MPI_COMM_WORLD,
                          &status);
-                results[repeats*ii + jj] = MPI_Wtime() - t;
+                sample = MPI_Wtime() - t;
+                results[max_repeats*ii + jj] = sample;
+
+                // Insertion into the sorted samples so far
+                for(kk=jj; kk>0 && sorted[kk - 1] > sample; kk--){
+                    sorted[kk] = sorted[kk - 1];
+                }
+                sorted[kk] = sample;
+
+                if(jj + 1 < min_repeats){
+                    continue;
+                }
+                if((median_rel_width(sorted, jj + 1) < rel_width)
+                   || ((time_budget > 0) && (MPI_Wtime() - start > time_budget/mslen))){
+                    jj++;
+                    break;
+                }
+            }
+            if(jj < max_repeats){
+                // Any tag other than the next expected one tells pong to stop
+                tag = PING_TAG(mesg_size, ping, jj + 1);
+                MPI_Send(send, 0, MPI_BYTE, pong, tag, MPI_COMM_WORLD);
+            }
+            if(taken != NULL){
+                taken[ii] = jj;
             }
             // Free here
             free(send);
             free(recv);
         }
+        free(sorted);
         MPI_Barrier(MPI_COMM_WORLD);
     }else if(rank == pong){
         for(ii=0; ii<mslen; ii++){
             // Malloc here
-            mesg_size = BLOCK*message_sizes[ii];
-            recv = empty_buff(mesg_size);
-            for(jj=0; jj<repeats; jj++){
+            mesg_size = message_sizes[ii];
+            nelem = (mesg_size + sizeof(int32_t) - 1)/sizeof(int32_t);
+            recv = empty_buff(nelem);
+            for(jj=0; jj<max_repeats; jj++){
                 MPI_Recv(recv,
                          mesg_size,
-                         MPI_INT32_T,
+                         MPI_BYTE,
                          ping,
-                         (10*mesg_size*ping + jj)%MAX_INT,
+                         MPI_ANY_TAG,
                          MPI_COMM_WORLD,
                          &status);
+                if(status.MPI_TAG != PING_TAG(mesg_size, ping, jj)){
+                    break;
+                }
                 MPI_Send(recv,
                          mesg_size,
-                         MPI_INT32_T,
+                         MPI_BYTE,
                          ping,
-                         (20*mesg_size*pong + jj)%MAX_INT,
+                         PONG_TAG(mesg_size, pong, jj),
                          MPI_COMM_WORLD);
             }
             // Free here
@@ -162,6 +247,4 @@ double *pingpong(int ping, int pong, int *message_sizes, int mslen, int repeats)
     }else{
         MPI_Barrier(MPI_COMM_WORLD);
     }
-
-    return results;
 }
@@ -1,11 +1,11 @@
 import numpy as np
 
 from argparse import ArgumentParser
-from itertools import combinations, repeat
+from fitting import line_fit, log_sizes, size2val
 from mpi4py import MPI
 from pathlib import Path
 from pickle import dump
-from time import time
+from schedule import partner, schedule
 
 comm = MPI.COMM_WORLD
 size = comm.size
@@ -16,78 +16,120 @@ assert size != 1, 'Running in serial, no ping pong results'
 # Parse command line arguments
 parser = ArgumentParser()
 parser.add_argument('-o', '--output', default='results.pickle')
+parser.add_argument('-s', '--schedule', choices=['roundrobin', 'serial'], default='roundrobin',
+                    help='All pairs in concurrent rounds, or one pair at a time without contention')
+parser.add_argument('-r', '--repeats', type=int, default=1000,
+                    help='Back to back round trips per batch for the smallest message, fewer for larger ones')
+parser.add_argument('-b', '--batches', type=int, default=5, help='Timed batches per message size')
+parser.add_argument('--warmup', type=int, default=10, help='Untimed round trips per message size')
+parser.add_argument('--min_size', type=str, default='8', help='Smallest message size in bytes')
+parser.add_argument('--max_size', type=str, default='8M', help='Largest message size in bytes')
+parser.add_argument('--sizes', type=int, default=8, help='Number of log spaced message sizes')
 args, _ = parser.parse_known_args()
 
-# Generate some large arrays
-BLOCK = 1024
-SMALL = BLOCK
-LARGE = 1024*BLOCK
+# Preallocated byte buffers so counts are exactly the message size
+array_sizes = log_sizes(size2val(args.min_size), size2val(args.max_size), args.sizes)
+largest = array_sizes[-1]
 rng = np.random.Generator(np.random.PCG64(rank))
-small_send = rng.integers(1024**2, size=SMALL)
-large_send = rng.integers(1024**2, size=LARGE)
+send_buf = rng.integers(256, size=largest, dtype=np.uint8)
+recv_buf = np.zeros(largest, dtype=np.uint8)
 
-small_recv = np.zeros(SMALL)
-large_recv = np.zeros(LARGE)
 
-# Results
+def timer_overhead(calls=10000):
+    ''' Cost of a call to MPI.Wtime, subtracted from every timed batch
+    '''
+    t = MPI.Wtime()
+    for _ in range(calls):
+        MPI.Wtime()
+    return (MPI.Wtime() - t)/calls
+
+
+class PersistentPingPong(object):
+    ''' Round trips between one pair using persistent requests, so the
+    message envelope is set up once and each iteration only starts and
+    completes the requests
+    '''
+    def __init__(self, ping, pong, count):
+        self.ping = rank == ping
+        other = pong if self.ping else ping
+        self.send = comm.Send_init([send_buf, count, MPI.BYTE], dest=other, tag=1 if self.ping else 2)
+        self.recv = comm.Recv_init([recv_buf, count, MPI.BYTE], source=other, tag=2 if self.ping else 1)
+        self.requests = [self.recv, self.send]
+
+    def __call__(self, repeats):
+        ''' Time for `repeats` round trips back to back, only meaningful on
+        the ping rank
+        '''
+        send, recv, requests = self.send, self.recv, self.requests
+        if self.ping:
+            t = MPI.Wtime()
+            for _ in range(repeats):
+                # Reply receive is posted before the send goes out
+                MPI.Prequest.Startall(requests)
+                MPI.Request.Waitall(requests)
+            return MPI.Wtime() - t
+        for _ in range(repeats):
+            recv.Start()
+            recv.Wait()
+            send.Start()
+            send.Wait()
+        return 0.0
+
+    def free(self):
+        self.send.Free()
+        self.recv.Free()
+
+
+def repeats_for(count):
+    # Roughly constant time per batch above a few kB
+    return max(10, int(args.repeats*min(1, 4096/count)))
+
+
+overhead = timer_overhead()
+
+# Results, per pair the batch mean round trip time of each message size
 local_results = {}
 
-# Compare rank 0 to all others if communicator count too large
-if size > 32:
-    # O(n)
-    pairs = zip(repeat(0), range(1, size))
-else:
-    # O(n**2)
-    pairs = combinations(range(size), 2)
+# Rounds of disjoint pairs, each round is separated by a barrier
+rounds = schedule(size, args.schedule)
 
 # Perform ping pong test on all pairs
-for ping, pong in pairs:
-    if rank==0:
-        pass
-        # ~ print(f'Ping {ping}, Pong {pong}', flush=True)
-    if rank == ping:
-        # Small buffer
-        short = time()
-        comm.Send([small_send, MPI.INT], dest=pong, tag=10*ping)
-        comm.Recv([small_recv, MPI.INT], source=pong, tag=20*pong)
-        short = time() - short
-        # Large buffer
-        llong = time()
-        comm.Send([large_send, MPI.INT], dest=pong, tag=30*ping)
-        comm.Recv([large_recv, MPI.INT], source=pong, tag=40*pong)
-        llong = time() - llong
-        # ~ print(f'Short: {short}', flush=True)
-        # ~ print(f'Long: {llong}', flush=True)
-        local_results[(ping, pong)] = (short, llong)
-        comm.Barrier()
-    elif rank == pong:
-        # Small
-        comm.Recv([small_recv, MPI.INT], source=ping, tag=10*ping)
-        comm.Send([small_recv, MPI.INT], dest=ping, tag=20*pong)
-        # Large
-        comm.Recv([large_recv, MPI.INT], source=ping, tag=30*ping)
-        comm.Send([large_recv, MPI.INT], dest=ping, tag=40*pong)
-        comm.Barrier()
-    else:
+for pairs in rounds:
+    mine = partner(pairs, rank)
+    if mine is None:
         comm.Barrier()
+        continue
+    ping, pong = mine
+    times = []
+    for count in array_sizes:
+        pp = PersistentPingPong(ping, pong, count)
+        pp(args.warmup)
+        repeats = repeats_for(count)
+        times.append(np.array([(pp(repeats) - overhead)/repeats for _ in range(args.batches)]))
+        pp.free()
+    if rank == ping:
+        local_results[(ping, pong)] = times
+    comm.Barrier()
 
 # Gather all results
-if size > 32:
-    results = [local_results]
-else:
-    results = comm.gather(local_results, root=0)
+results = comm.gather(local_results, root=0)
 
 if rank==0:
     all_results = {}
     for r in results:
         all_results.update(r)
+    all_results = dict(sorted(all_results.items()))
 
+    # 8 bits to a byte sent back _and_ forth
+    x = 16*np.array(array_sizes, dtype=float)
     rates = []
     latencies = []
-    for t1, t2 in all_results.values():
-        r = (8*(LARGE - SMALL))/(t2 - t1)
-        rates.append(r)
-        latencies.append(t1 - SMALL/r)
+    for val in all_results.values():
+        m, c, _ = line_fit(x, np.array([np.min(v) for v in val]))
+        rates.append(float(1/m))
+        latencies.append(float(c))
     outfile = Path(args.output).absolute()
     with open(outfile, 'wb') as fh:
         dump((latencies, rates), fh)
+    with open(outfile.with_suffix('.detailed.pickle'), 'wb') as fh:
+        dump((array_sizes, {k: [len(v) for v in val] for k, val in all_results.items()}, all_results), fh)
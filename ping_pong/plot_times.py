@@ -2,6 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from argparse import ArgumentParser
+from fitting import line_fits
 from pathlib import Path
 from pickle import load
 
@@ -51,53 +52,94 @@ if True:
     plt_name = inputfile.with_suffix('.scatter.png')
     fig.savefig(plt_name, bbox_inches='tight', dpi=DPI)
 
-if False:
-    BLOCK = 1024
-    with open(inputfile.with_suffix('.detailed.pickle'), 'rb') as fh:
-        array_sizes, repeats, results = load(fh)
+regimes_file = inputfile.with_suffix('.regimes.pickle')
+if regimes_file.exists():
+    with open(regimes_file, 'rb') as fh:
+        array_sizes, pair_regimes = load(fh)
+
+    fig, ax = plt.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+    fig.set_size_inches((8, 10))
+    sizes = np.array(array_sizes, dtype=float)
+    alpha = max(0.05, 1/np.sqrt(len(pair_regimes)))
+    for reg in pair_regimes.values():
+        for ii, r in enumerate(reg['regimes']):
+            s = sizes[(sizes >= r['smallest']) & (sizes <= r['largest'])]
+            # Fit is in bits sent back and forth against time
+            ax[0].loglog(s, r['slope']*16*s + r['latency'], '-', color=f'C{ii}', alpha=alpha)
+    for ii in range(max(len(reg['regimes']) for reg in pair_regimes.values())):
+        ax[0].plot([], [], '-', color=f'C{ii}', label=f'Regime {ii + 1}')
+    ax[0].set_title('Piecewise fit of median round trip time')
+    ax[0].set_ylabel('time (s)')
+    ax[0].legend()
+
+    breakpoints = sum((reg['breakpoints'] for reg in pair_regimes.values()), [])
+    if breakpoints:
+        ax[1].hist(breakpoints, bins=np.geomspace(sizes[0], sizes[-1], 4*int(np.log2(sizes[-1]/sizes[0]) + 1)))
+    ax[1].set_title('Detected protocol switches')
+    ax[1].set_xlabel('Message size (bytes)')
+    ax[1].set_ylabel('frequency')
+    fig.suptitle(args.title)
+
+    plt_name = inputfile.with_suffix('.regimes.png')
+    fig.savefig(plt_name, bbox_inches='tight', dpi=DPI)
+
+detailed_file = inputfile.with_suffix('.detailed.pickle')
+detailed = None
+if detailed_file.exists():
+    with open(detailed_file, 'rb') as fh:
+        detailed = load(fh)
+    # collectives.py keeps (sizes, results per collective) here, with no pairs to fit
+    if len(detailed) != 3:
+        print(f'No per pair samples in {detailed_file.name}, skipping the detailed plots')
+        detailed = None
+if detailed is not None:
+    array_sizes, taken, results = detailed
 
     # 8 Bits to a byte sent back _and_ forth
-    x = np.array([16*BLOCK*a for a in array_sizes])
-    x_range = np.linspace(x[0], x[-1], 100)
-
-    cols = int(np.ceil(np.sqrt(len(results))))
-    rows = int(np.ceil(len(results)/cols))
-    fig, axes = plt.subplots(rows, cols, sharey=True, squeeze=False, figsize=(16, 9))
-    for ax, (key, val) in zip(axes.ravel(), results.items()):
-        y = np.array(val)
-        y_mean = np.mean(y, axis=1)
-        mean_m, mean_c = np.polyfit(x, y_mean, deg=1)
-        # ~ print('Rate:', mean_m, 'bits/sec, Latency:', mean_c, 'sec')
-        y_median = np.median(y, axis=1)
-        median_m, median_c = np.polyfit(x, y_median, deg=1)
-        y_min = np.min(y, axis=1)
-        min_m, min_c = np.polyfit(x, y_min, deg=1)
-        box_info = ax.boxplot(val,
-                              sym='b+',
-                              positions=x,
-                              widths=100*BLOCK,
-                              showfliers=False,
-                              # ~ showmeans=True,
-                              # ~ meanprops={'marker': 'x', 'mec': 'r'}
-                              )
-        #ax.plot(x, y_mean, 'r-')
-        ax.plot(x_range, mean_m*x_range + mean_c, 'r-', label='Mean fit')
-        ax.plot(x, y_median, 'x', color='orange')
-        ax.plot(x_range, median_m*x_range + median_c, '-', color='orange', label='Median fit')
-        ax.annotate(f'Rate   : {1/median_m:7.5g} bits/s\nLatency: {median_c:7.5g}s',
-                    (0.1, 0.8),
-                    xycoords='axes fraction',
-                    color='orange')
-        ax.plot(x, y_min, 'gx')
-        ax.plot(x_range, min_m*x_range + min_c, 'g-', label='Min fit')
-        ax.set_title(str(key))
-        ax.set_xlabel('bits transferred')
-        ax.xaxis.set_label_coords(0.8, 0.05, transform=ax.transAxes)
-        ax.set_ylabel('time (s)')
-        ax.set_xticklabels(x, rotation=22.5, ha="right")
-
-
-    axes.ravel()[0].legend()
+    x = np.array([16*a for a in array_sizes], dtype=float)
+    keys = np.array(list(results.keys()))
+    # Number of repeats can differ between pairs and message sizes, so pad
+    # every (pair, size) out to the most samples taken with NaN
+    counts = np.array([[len(v) for v in val] for val in results.values()])
+    samples = np.full((*counts.shape, counts.max()), np.nan)
+    mask = np.arange(counts.max()) < counts[..., None]
+    samples[mask] = np.concatenate([np.concatenate(val) for val in results.values()])
+    stats = {'Mean': np.nanmean(samples, axis=2),
+             'Median': np.nanmedian(samples, axis=2),
+             'Min': np.nanmin(samples, axis=2)}
+
+    # Every pair and statistic fitted at once, minimising relative error as
+    # the regimes fit does so small messages set the latency
+    m, c = line_fits(x, np.concatenate(list(stats.values())).T)
+    fits = {name: (1/mm, cc) for name, mm, cc in zip(stats, np.split(m, len(stats)), np.split(c, len(stats)))}
+
+    # Median fit as rank x rank matrices
+    n = keys.max() + 1
+    rate_matrix = np.full((n, n), np.nan)
+    latency_matrix = np.full((n, n), np.nan)
+    rate_matrix[keys[:, 0], keys[:, 1]] = rate_matrix[keys[:, 1], keys[:, 0]] = fits['Median'][0]
+    latency_matrix[keys[:, 0], keys[:, 1]] = latency_matrix[keys[:, 1], keys[:, 0]] = fits['Median'][1]
+
+    fig, ax = plt.subplots(2, 2)
+    fig.set_size_inches((16, 14))
+    for a, matrix, label in [(ax[0, 0], latency_matrix, 'Latency (s)'), (ax[0, 1], rate_matrix, 'Rate (bits/s)')]:
+        im = a.imshow(matrix, interpolation='nearest')
+        fig.colorbar(im, ax=a, label=label, shrink=0.8)
+        a.set_title(f'Median fit {label.split()[0].lower()}')
+        a.set_xlabel('rank')
+        a.set_ylabel('rank')
+
+    bins = max(10, int(np.sqrt(len(keys))))
+    for name, (rate, latency) in fits.items():
+        ax[1, 0].hist(latency, bins=bins, histtype='step', label=f'{name} fit')
+        ax[1, 1].hist(rate, bins=bins, histtype='step', label=f'{name} fit')
+    ax[1, 0].set_title('Latency Time')
+    ax[1, 0].set_xlabel('time (s)')
+    ax[1, 0].set_ylabel('frequency')
+    ax[1, 1].set_title('Rate')
+    ax[1, 1].set_xlabel('Rate (bits/s)')
+    ax[1, 1].set_ylabel('frequency')
+    ax[1, 0].legend()
     fig.suptitle(args.title)
     fig.subplots_adjust(hspace=0.3)
 
@@ -2,10 +2,11 @@ import ctypes
 import numpy as np
 
 from argparse import ArgumentParser
-from itertools import combinations, repeat
+from fitting import log_sizes, regimes, size2val
 from mpi4py import MPI
 from pathlib import Path
 from pickle import dump
+from schedule import partner, schedule
 from time import time
 
 comm = MPI.COMM_WORLD
@@ -16,90 +17,173 @@ assert size != 1, 'Running in serial, no ping pong results'
 
 class CPingPong(object):
     ''' Class for handling wrapped C function
+
+    Results are written by C straight into NumPy arrays allocated once here
+    and reused for every pair, so the arrays returned by a call are only
+    valid until the next call.
     '''
-    def __init__(self):
-        # COMPILE C WITH: mpicc -fPIC -shared -o omp_cpu.so omp_cpu.c
+    def __init__(self, mesg_sizes, max_repeats):
+        # COMPILE C WITH: mpicc -fPIC -shared -o pingpong.so pingpong.c -lm
         # Import shared object
         self.pingpong_so = ctypes.CDLL('./pingpong.so')
-        # double *pingpong(int ping, int pong, int *message_sizes, int mslen, int repeats)
+        # void pingpong_adaptive(int ping, int pong, int *message_sizes, int mslen,
+        #                        int min_repeats, int max_repeats, double rel_width,
+        #                        double time_budget, double *results, int *taken)
         # Specify argument type
-        self.pingpong_so.pingpong.argtype = (ctypes.c_int,
-                                             ctypes.c_int,
-                                             ctypes.POINTER(ctypes.c_int),
-                                             ctypes.c_int,
-                                             ctypes.c_int
-                                             )
+        self.pingpong_so.pingpong_adaptive.argtypes = (ctypes.c_int,
+                                                       ctypes.c_int,
+                                                       np.ctypeslib.ndpointer(np.intc, ndim=1, flags='C_CONTIGUOUS'),
+                                                       ctypes.c_int,
+                                                       ctypes.c_int,
+                                                       ctypes.c_int,
+                                                       ctypes.c_double,
+                                                       ctypes.c_double,
+                                                       np.ctypeslib.ndpointer(np.float64, ndim=2, flags='C_CONTIGUOUS'),
+                                                       np.ctypeslib.ndpointer(np.intc, ndim=1, flags='C_CONTIGUOUS')
+                                                       )
         # Specify return type
-        self.pingpong_so.pingpong.restype = ctypes.POINTER(ctypes.c_double)
+        self.pingpong_so.pingpong_adaptive.restype = None
+
+        self.mesg_sizes = np.ascontiguousarray(mesg_sizes, dtype=np.intc)
+        self.max_repeats = max_repeats
+        self.results = np.zeros((len(self.mesg_sizes), max_repeats))
+        self.taken = np.zeros(len(self.mesg_sizes), dtype=np.intc)
+
+    def __call__(self, ping, pong, repeats=10, rel_width=0, time_budget=0, share=True):
+        ''' Wrapper for C function pingpong_adaptive, returning the
+        (message sizes, max_repeats) array of timings and the number of
+        samples taken for each message size.
 
-    def __call__(self, ping, pong, mesg_sizes, repeats=10):
-        ''' Wrapper for C function pingpong
+        Each size is repeated at least `repeats` and at most `max_repeats`
+        times, stopping once the 95% confidence interval of the median is
+        narrower than `rel_width` times the median or the pair has used up
+        `time_budget` seconds. Results are broadcast from the ping rank if
+        `share`, otherwise only filled in on the ping rank. Pass
+        ping = pong = -1 on ranks sitting out a concurrent round, which
+        only works with `share` off since there is no rank to broadcast from.
         '''
         comm = MPI.COMM_WORLD
         assert ping < comm.size, 'Ping rank bigger than comm size'
         assert pong < comm.size, 'Pong rank bigger than comm size'
-        assert isinstance(mesg_sizes, list)
-
-        mslen = len(mesg_sizes)
-        message_sizes = (ctypes.c_int*mslen)()
-        message_sizes[:] = mesg_sizes
-        results = self.pingpong_so.pingpong(ctypes.c_int(ping),
-                                            ctypes.c_int(pong),
-                                            message_sizes,
-                                            ctypes.c_int(mslen),
-                                            ctypes.c_int(repeats))
-
-        if comm.rank == ping:
-            results = results[:mslen*repeats]
-        results = comm.bcast(results, root=ping)
-        return results
+        assert ping >= 0 or not share, 'No ping rank to share results from, pass share=False'
+        assert self.max_repeats >= repeats, 'Maximum repeats less than minimum'
+
+        self.taken[:] = 0
+        self.pingpong_so.pingpong_adaptive(ping,
+                                           pong,
+                                           self.mesg_sizes,
+                                           len(self.mesg_sizes),
+                                           repeats,
+                                           self.max_repeats,
+                                           rel_width,
+                                           time_budget,
+                                           self.results,
+                                           self.taken)
+        if share:
+            comm.Bcast(self.taken, root=ping)
+            comm.Bcast(self.results, root=ping)
+        return self.results, self.taken
+
+
+def gather_round(cpingpong, ping, pong, root=0):
+    ''' Gather one concurrent round's samples onto `root` with buffer
+    based collectives, returning {(ping, pong): [samples per size]} there
+    '''
+    comm = MPI.COMM_WORLD
+    meta = np.full(2 + len(cpingpong.mesg_sizes), -1, dtype=np.intc)
+    if comm.rank == ping:
+        meta[:2] = ping, pong
+        meta[2:] = cpingpong.taken
+    else:
+        meta[2:] = 0
+    all_meta = np.empty((comm.size, len(meta)), dtype=np.intc) if comm.rank == root else None
+    comm.Gather(meta, all_meta, root=root)
+
+    # Only the valid samples are sent, packed one size after another
+    send = np.concatenate([cpingpong.results[ii, :n] for ii, n in enumerate(meta[2:])])
+    if comm.rank != root:
+        comm.Gatherv(send, None, root=root)
+        return {}
+    counts = all_meta[:, 2:].sum(axis=1)
+    recv = np.empty(counts.sum())
+    comm.Gatherv(send, [recv, counts], root=root)
+
+    gathered = {}
+    offsets = np.cumsum(counts) - counts
+    for row, offset, count in zip(all_meta, offsets, counts):
+        if row[0] < 0:
+            continue
+        samples = recv[offset:offset + count]
+        gathered[(int(row[0]), int(row[1]))] = np.split(samples, np.cumsum(row[2:])[:-1])
+    return gathered
 
 # Parse command line arguments
 parser = ArgumentParser()
 parser.add_argument('-o', '--output', default='results.pickle')
+parser.add_argument('-s', '--schedule', choices=['roundrobin', 'serial'], default='roundrobin',
+                    help='All pairs in concurrent rounds, or one pair at a time without contention')
+parser.add_argument('-r', '--repeats', type=int, default=5, help='Minimum repeats of each message size')
+parser.add_argument('--max_repeats', type=int, default=1000, help='Maximum repeats of each message size')
+parser.add_argument('--rel_width', type=float, default=0.05,
+                    help='Target width of the confidence interval of the median, relative to the median')
+parser.add_argument('--budget', type=float, default=2.0, help='Time budget (s) per pair, 0 for no limit')
+parser.add_argument('--min_size', type=str, default='1', help='Smallest message size in bytes, e.g. 1 or 4k')
+parser.add_argument('--max_size', type=str, default='256M', help='Largest message size in bytes, e.g. 256M')
+parser.add_argument('--sizes', type=int, default=40, help='Number of log spaced message sizes')
+parser.add_argument('--max_regimes', type=int, default=4, help='Most protocol regimes to fit per pair')
 args, _ = parser.parse_known_args()
 
-# Different size arrays (will be multiplied by BLOCK=1024) to send
-BLOCK = 1024
-repeats = 20
-array_sizes = [1, 10, 20, 40, 70, 100]
+# Log spaced message sizes in bytes
+array_sizes = log_sizes(size2val(args.min_size), size2val(args.max_size), args.sizes)
 
 # Results
 local_results = {}
 
-# Compare rank 0 to all others if communicator count too large
-if size > 32:
-    # O(n)
-    pairs = zip(repeat(0), range(1, size))
-else:
-    # O(n**2)
-    pairs = combinations(range(size), 2)
+# Rounds of disjoint pairs, each ends with the barrier inside pingpong()
+rounds = schedule(size, args.schedule)
 
 # Perform ping pong test on all pairs
-cpingpong = CPingPong()
+cpingpong = CPingPong(array_sizes, args.max_repeats)
 comm.Barrier()
-for ping, pong in pairs:
+for ii, pairs in enumerate(rounds):
     if rank==0:
-        print(f'Ping {ping}, Pong {pong}', flush=True)
-    results = cpingpong(ping, pong, array_sizes, repeats=repeats)
-    local_results[(ping, pong)] = [results[ii:ii+repeats] for ii in range(0, len(results), repeats)]
-    comm.Barrier()
+        print(f'Round {ii + 1}/{len(rounds)}: {len(pairs)} pairs', flush=True)
+    ping, pong = partner(pairs, rank) or (-1, -1)
+    cpingpong(ping, pong,
+              repeats=args.repeats,
+              rel_width=args.rel_width,
+              time_budget=args.budget,
+              share=False)
+    local_results.update(gather_round(cpingpong, ping, pong))
 
 if rank==0:
-    # 8 Bits to a byte sent back _and_ forth
-    x = np.array([16*BLOCK*a for a in array_sizes])
+    local_results = dict(sorted(local_results.items()))
 
+# Hostnames let the topology analysis check inferred nodes
+hostnames = comm.gather(MPI.Get_processor_name(), root=0)
+
+if rank==0:
     rates = []
     latencies = []
-    for dat in local_results.values():
-        y = np.array(dat)
-        y_mean = np.mean(y, axis=1)
-        mean_m, mean_c = np.polyfit(x, y_mean, deg=1)
-        rates.append(1/mean_m)
-        latencies.append(mean_c)
+    # Samples taken for each pair and message size
+    taken = {}
+    # Piecewise fit of the median times, breakpoints are protocol switches
+    pair_regimes = {}
+    for key, dat in local_results.items():
+        taken[key] = [len(d) for d in dat]
+        y_median = np.array([np.median(d) for d in dat])
+        pair_regimes[key] = regimes(array_sizes, y_median, max_segments=args.max_regimes)
+        # Small message latency and large message rate
+        latencies.append(pair_regimes[key]['regimes'][0]['latency'])
+        rates.append(pair_regimes[key]['regimes'][-1]['rate'])
+        print(key, 'switches at', pair_regimes[key]['breakpoints'], 'bytes')
     print(latencies, rates)
     outfile = Path(args.output).absolute()
     with open(outfile, 'wb') as fh:
         dump((latencies, rates), fh)
     with open(outfile.with_suffix('.detailed.pickle'), 'wb') as fh:
-        dump((array_sizes, repeats, local_results), fh)
+        dump((array_sizes, taken, local_results), fh)
+    with open(outfile.with_suffix('.regimes.pickle'), 'wb') as fh:
+        dump((array_sizes, pair_regimes), fh)
+    with open(outfile.with_suffix('.hostnames.pickle'), 'wb') as fh:
+        dump(hostnames, fh)
@@ -0,0 +1,54 @@
+from itertools import combinations, repeat
+
+
+def round_robin(size):
+    ''' Every pair of ranks exactly once, grouped into size - 1 rounds (size
+    rounds for odd size) of disjoint pairs using the circle method.
+    Within a round all pairs can exchange at the same time.
+    '''
+    ranks = list(range(size))
+    if size % 2:
+        # Partner of the dummy sits the round out
+        ranks.append(None)
+    n = len(ranks)
+    rounds = []
+    for _ in range(n - 1):
+        pairs = []
+        for ii in range(n//2):
+            a, b = ranks[ii], ranks[n - 1 - ii]
+            if a is not None and b is not None:
+                pairs.append((min(a, b), max(a, b)))
+        rounds.append(pairs)
+        # Rotate everything except the first rank
+        ranks = [ranks[0], ranks[-1]] + ranks[1:-1]
+    return rounds
+
+
+def serial(size):
+    ''' One pair per round, only comparing rank 0 to all other ranks if the
+    communicator is too large to test every pair one at a time
+    '''
+    if size > 32:
+        # O(n)
+        pairs = zip(repeat(0), range(1, size))
+    else:
+        # O(n**2)
+        pairs = combinations(range(size), 2)
+    return [[p] for p in pairs]
+
+
+def schedule(size, kind='roundrobin'):
+    if kind == 'roundrobin':
+        return round_robin(size)
+    elif kind == 'serial':
+        return serial(size)
+    raise ValueError(f'Unknown schedule {kind}')
+
+
+def partner(pairs, rank):
+    ''' The (ping, pong) pair `rank` belongs to this round, or None
+    '''
+    for ping, pong in pairs:
+        if rank in (ping, pong):
+            return ping, pong
+    return None
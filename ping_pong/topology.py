@@ -0,0 +1,199 @@
+import json
+
+import numpy as np
+
+from argparse import ArgumentParser
+from pathlib import Path
+from pickle import load
+
+
+def pair_matrices(pair_regimes, size=None):
+    ''' Symmetric rank x rank matrices of small message latency and large
+    message rate from the piecewise fits, NaN for pairs never measured
+    '''
+    if size is None:
+        size = max(max(key) for key in pair_regimes) + 1
+    latency = np.full((size, size), np.nan)
+    rate = np.full((size, size), np.nan)
+    keys = np.array(list(pair_regimes.keys()))
+    lat = np.array([reg['regimes'][0]['latency'] for reg in pair_regimes.values()])
+    bw = np.array([reg['regimes'][-1]['rate'] for reg in pair_regimes.values()])
+    latency[keys[:, 0], keys[:, 1]] = latency[keys[:, 1], keys[:, 0]] = lat
+    rate[keys[:, 0], keys[:, 1]] = rate[keys[:, 1], keys[:, 0]] = bw
+    np.fill_diagonal(latency, 0)
+    np.fill_diagonal(rate, np.inf)
+    return latency, rate
+
+
+def breaks(latency, levels=3, min_ratio=1.5):
+    ''' Latency thresholds separating the tiers of the machine, placed
+    (geometrically) in the middle of the `levels` widest gaps between sorted
+    pair latencies, counting only gaps wider than a factor of `min_ratio`
+    '''
+    values = latency[np.triu_indices_from(latency, k=1)]
+    values = np.unique(values[np.isfinite(values) & (values > 0)])
+    if len(values) < 2:
+        return []
+    gaps = np.diff(np.log(values))
+    widest = np.argsort(gaps)[::-1][:levels]
+    widest = np.sort(widest[gaps[widest] >= np.log(min_ratio)])
+    return [float(np.sqrt(values[ii]*values[ii + 1])) for ii in widest]
+
+
+def components(adjacent):
+    ''' Connected component labels 0..k-1 of a boolean adjacency matrix, by
+    min label propagation with pointer jumping over all ranks at once
+    '''
+    n = len(adjacent)
+    labels = np.arange(n)
+    while True:
+        new = np.minimum(labels, np.where(adjacent, labels[None, :], n).min(axis=1))
+        new = new[new]
+        if np.array_equal(new, labels):
+            break
+        labels = new
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def refine(coarse, fine):
+    ''' Labels of the intersection of two partitions, numbered in order
+    '''
+    return np.unique(np.column_stack((coarse, fine)), axis=0, return_inverse=True)[1].ravel()
+
+
+def sockets(latency, node, min_ratio=1.5):
+    ''' Socket labels of each rank from the latencies inside its own node.
+    Every node is split at the widest gap between its own pair latencies,
+    so nodes of different types or with ranks placed differently each get
+    their own threshold.
+    '''
+    socket = np.zeros(len(node), dtype=int)
+    for n in np.unique(node):
+        members = np.flatnonzero(node == n)
+        sub = latency[np.ix_(members, members)]
+        thresholds = breaks(sub, levels=1, min_ratio=min_ratio)
+        if thresholds:
+            socket[members] = components(np.nan_to_num(sub, nan=np.inf) <= thresholds[0])
+    return socket
+
+
+def infer(latency, hostnames=None, levels=3, min_ratio=1.5):
+    ''' Hierarchical single linkage clustering of ranks on latency.
+
+    Each threshold from `breaks` gives a partition into connected components
+    of the graph of pairs at most that far apart, so partitions are nested
+    from finest to coarsest. With hostnames the node level is taken from
+    them and the finest partition joining nodes is the switch level.
+    Without hostnames the two coarsest of three or more partitions are node
+    and switch, with fewer the finest is taken as nodes and sockets are not
+    resolved. Sockets are then found inside each node by `sockets`.
+    '''
+    n = len(latency)
+    thresholds = breaks(latency, levels=levels, min_ratio=min_ratio)
+    partitions = []
+    for th in thresholds:
+        labels = components(np.nan_to_num(latency, nan=np.inf) <= th)
+        if 1 < labels.max() + 1 < n and not any(np.array_equal(labels, p) for p in partitions):
+            partitions.append(labels)
+
+    if hostnames is not None:
+        node = np.unique(hostnames, return_inverse=True)[1].ravel()
+        socket = sockets(latency, node, min_ratio=min_ratio)
+        coarser = [p for p in partitions if p.max() < node.max()]
+        switch = coarser[0] if coarser else np.zeros(n, dtype=int)
+    else:
+        socket = node = partitions[0] if partitions else np.zeros(n, dtype=int)
+        switch = partitions[1] if len(partitions) > 1 else np.zeros(n, dtype=int)
+        if len(partitions) > 2:
+            node, switch = partitions[-2:]
+            socket = sockets(latency, node, min_ratio=min_ratio)
+    # Groups numbered within their parents so they are nested
+    node = refine(switch, node)
+    socket = refine(node, socket)
+    return {'thresholds': thresholds, 'switch': switch, 'node': node, 'socket': socket}
+
+
+def group_map(groups, hostnames=None):
+    ''' JSON serialisable rank to group map, with ranks listed in the order
+    of the reordered heatmap so neighbours share as much as possible
+    '''
+    n = len(groups['node'])
+    order = np.lexsort((np.arange(n), groups['socket'], groups['node'], groups['switch']))
+    ranks = []
+    for r in range(n):
+        ranks.append({'rank': r,
+                      'hostname': None if hostnames is None else hostnames[r],
+                      'switch': int(groups['switch'][r]),
+                      'node': int(groups['node'][r]),
+                      'socket': int(groups['socket'][r])})
+    return {'levels': ['switch', 'node', 'socket'],
+            'thresholds': groups['thresholds'],
+            'groups': {level: int(groups[level].max() + 1) for level in ['switch', 'node', 'socket']},
+            'order': [int(r) for r in order],
+            'ranks': ranks}
+
+
+def heatmap(latency, rate, groups, order, title=None):
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    fig, ax = plt.subplots(1, 2)
+    fig.set_size_inches((16, 8))
+    latency = latency[np.ix_(order, order)].copy()
+    rate = rate[np.ix_(order, order)].copy()
+    np.fill_diagonal(latency, np.nan)
+    np.fill_diagonal(rate, np.nan)
+    for a, data, label in [(ax[0], latency, 'Latency (s)'), (ax[1], rate, 'Rate (bits/s)')]:
+        finite = data[np.isfinite(data) & (data > 0)]
+        norm = LogNorm(finite.min(), finite.max()) if len(finite) else None
+        im = a.imshow(data, norm=norm, interpolation='nearest')
+        fig.colorbar(im, ax=a, label=label, shrink=0.8)
+        # Group boundaries in the reordered ranks
+        for level, style in [('node', 'w-'), ('switch', 'r-')]:
+            labels = groups[level][order]
+            for edge in np.flatnonzero(np.diff(labels)) + 0.5:
+                a.plot([edge, edge], [-0.5, len(order) - 0.5], style, lw=0.5)
+                a.plot([-0.5, len(order) - 0.5], [edge, edge], style, lw=0.5)
+        a.set_xlim(-0.5, len(order) - 0.5)
+        a.set_ylim(len(order) - 0.5, -0.5)
+        a.set_xlabel('rank (reordered)')
+        a.set_ylabel('rank (reordered)')
+        a.set_title(label.split()[0])
+    fig.suptitle(title)
+    return fig
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-i', '--input', default='results.pickle')
+    parser.add_argument('-o', '--output', help='Heatmap image, the group map is written next to it as JSON')
+    parser.add_argument('-t', '--title', type=str, default=None)
+    parser.add_argument('--levels', type=int, default=3, help='Most latency tiers to look for')
+    parser.add_argument('--min_ratio', type=float, default=1.5,
+                        help='Smallest latency ratio between neighbouring tiers')
+    args, _ = parser.parse_known_args()
+
+    inputfile = Path(args.input).absolute()
+    with open(inputfile.with_suffix('.regimes.pickle'), 'rb') as fh:
+        array_sizes, pair_regimes = load(fh)
+    hostnames = None
+    if inputfile.with_suffix('.hostnames.pickle').exists():
+        with open(inputfile.with_suffix('.hostnames.pickle'), 'rb') as fh:
+            hostnames = load(fh)
+
+    latency, rate = pair_matrices(pair_regimes, None if hostnames is None else len(hostnames))
+    missing = np.isnan(latency).sum()//2
+    if missing:
+        print(f'{missing} pairs were not measured, use the roundrobin schedule for a full matrix')
+    groups = infer(latency, hostnames, levels=args.levels, min_ratio=args.min_ratio)
+    mapping = group_map(groups, hostnames)
+    print('Groups:', mapping['groups'], 'thresholds:', mapping['thresholds'])
+
+    if args.output:
+        plt_name = Path(args.output).absolute()
+    else:
+        plt_name = inputfile.with_suffix('.topology.png')
+    fig = heatmap(latency, rate, groups, mapping['order'], title=args.title)
+    fig.savefig(plt_name, bbox_inches='tight', dpi=300)
+    with open(plt_name.with_suffix('.json'), 'w') as fh:
+        json.dump(mapping, fh, indent=1)
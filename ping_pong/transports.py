@@ -0,0 +1,179 @@
+import numpy as np
+
+from argparse import ArgumentParser
+from fitting import log_sizes, size2val
+from mpi4py import MPI
+from pathlib import Path
+from pickle import dump
+from schedule import partner, schedule
+
+comm = MPI.COMM_WORLD
+size = comm.size
+rank = comm.rank
+
+assert size != 1, 'Running in serial, no transport results'
+
+TRANSPORTS = ['twosided', 'shm', 'put', 'get', 'accumulate']
+
+# Parse command line arguments
+parser = ArgumentParser()
+parser.add_argument('-o', '--output', default='transports.pickle')
+parser.add_argument('-s', '--schedule', choices=['roundrobin', 'serial'], default='roundrobin',
+                    help='All pairs in concurrent rounds, or one pair at a time without contention')
+parser.add_argument('-t', '--transports', nargs='+', choices=TRANSPORTS, default=TRANSPORTS)
+parser.add_argument('-r', '--repeats', type=int, default=20, help='Timed transfers per message size')
+parser.add_argument('--warmup', type=int, default=2, help='Untimed transfers per message size')
+parser.add_argument('--min_size', type=str, default='8', help='Smallest message size in bytes')
+parser.add_argument('--max_size', type=str, default='4M', help='Largest message size in bytes')
+parser.add_argument('--sizes', type=int, default=12, help='Number of log spaced message sizes')
+args, _ = parser.parse_known_args()
+
+sizes = log_sizes(size2val(args.min_size), size2val(args.max_size), args.sizes)
+largest = sizes[-1]
+# Accumulate works on doubles so keep whole float64 elements
+largest += -largest % 8
+
+send = np.random.Generator(np.random.PCG64(rank)).integers(256, size=largest, dtype=np.uint8)
+recv = np.zeros(largest, dtype=np.uint8)
+
+# Ranks sharing memory, and the node each rank is on
+node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+node_of = comm.allgather(MPI.Get_processor_name())
+local_rank = comm.allgather(node.rank)
+
+# RMA target memory, exposed for the whole run with a passive target epoch
+win = MPI.Win.Allocate(largest, disp_unit=1, comm=comm)
+
+# Node shared segments, a cache line holding a flag and then the data,
+# exposed for the whole run with a passive target epoch like `win`
+LINE = 64
+shared = MPI.Win.Allocate_shared(LINE + largest, disp_unit=1, comm=node)
+
+
+def segment(local):
+    ''' (flag, data) views of the shared segment of `local` rank on this node
+    '''
+    buf, _ = shared.Shared_query(local)
+    seg = np.frombuffer(buf, dtype=np.uint8)
+    return seg[:8].view(np.int64), seg[LINE:]
+
+
+def twosided(ping, pong, count, repeats):
+    ''' Send/Recv round trips, as in the ping pong tools
+    '''
+    t = MPI.Wtime()
+    for _ in range(repeats):
+        if rank == ping:
+            comm.Send([send, count, MPI.BYTE], dest=pong, tag=1)
+            comm.Recv([recv, count, MPI.BYTE], source=pong, tag=2)
+        else:
+            comm.Recv([recv, count, MPI.BYTE], source=ping, tag=1)
+            comm.Send([recv, count, MPI.BYTE], dest=ping, tag=2)
+    return (MPI.Wtime() - t)/(2*repeats)
+
+
+def shm(ping, pong, count, repeats):
+    ''' Round trips by plain stores into the partner's shared segment, each
+    followed by a flag store the partner spins on
+    '''
+    my_flag, my_data = segment(node.rank)
+    other = pong if rank == ping else ping
+    their_flag, their_data = segment(local_rank[other])
+    # Neither side stores to the other's flag until both have reset theirs
+    my_flag[0] = 0
+    shared.Sync()
+    comm.Sendrecv([send, 0, MPI.BYTE], dest=other, recvbuf=[recv, 0, MPI.BYTE], source=other)
+    t = MPI.Wtime()
+    for ii in range(1, repeats + 1):
+        if rank == pong:
+            while my_flag[0] != ii:
+                shared.Sync()
+            their_data[:count] = my_data[:count]
+        else:
+            their_data[:count] = send[:count]
+        shared.Sync()
+        their_flag[0] = ii
+        if rank == ping:
+            while my_flag[0] != ii:
+                shared.Sync()
+    return (MPI.Wtime() - t)/(2*repeats)
+
+
+def one_sided(kind, ping, pong, count, repeats):
+    ''' Put, Get or Accumulate by ping into or out of pong's window, each
+    completed at the target by a flush before the next
+    '''
+    if rank != ping:
+        return None
+    t = MPI.Wtime()
+    for _ in range(repeats):
+        if kind == 'put':
+            win.Put([send, count, MPI.BYTE], pong)
+        elif kind == 'get':
+            win.Get([recv, count, MPI.BYTE], pong)
+        else:
+            n = max(1, count//8)
+            win.Accumulate([send.view(np.float64), n, MPI.DOUBLE], pong, op=MPI.SUM)
+        win.Flush(pong)
+    return (MPI.Wtime() - t)/repeats
+
+
+def transfer(kind, ping, pong, count, repeats):
+    if kind == 'twosided':
+        return twosided(ping, pong, count, repeats)
+    elif kind == 'shm':
+        return shm(ping, pong, count, repeats)
+    return one_sided(kind, ping, pong, count, repeats)
+
+
+# Results
+local_results = {}
+
+win.Lock_all()
+# Win.Sync on the shared segments needs an access epoch of its own
+shared.Lock_all(MPI.MODE_NOCHECK)
+rounds = schedule(size, args.schedule)
+for ii, pairs in enumerate(rounds):
+    if rank == 0:
+        print(f'Round {ii + 1}/{len(rounds)}: {len(pairs)} pairs', flush=True)
+    mine = partner(pairs, rank)
+    same_node = mine is not None and node_of[mine[0]] == node_of[mine[1]]
+    for kind in args.transports:
+        times = []
+        for count in sizes:
+            if mine is None or (kind == 'shm' and not same_node):
+                continue
+            transfer(kind, *mine, count, args.warmup)
+            times.append(transfer(kind, *mine, count, args.repeats))
+        if mine is not None and rank == mine[0]:
+            local_results.setdefault(mine, {'same_node': same_node})[kind] = times or None
+    comm.Barrier()
+shared.Unlock_all()
+win.Unlock_all()
+
+# Gather all results
+results = comm.gather(local_results, root=0)
+
+if rank==0:
+    all_results = {}
+    for r in results:
+        all_results.update(r)
+    all_results = dict(sorted(all_results.items()))
+
+    # Side by side medians over pairs of the time per transfer
+    for where in [True, False]:
+        chosen = [r for r in all_results.values() if r['same_node'] == where]
+        if not chosen:
+            continue
+        print('Intra-node' if where else 'Inter-node', f'({len(chosen)} pairs), time per transfer (s)')
+        kinds = [k for k in args.transports if chosen[0].get(k)]
+        print(f'{"bytes":>10}' + ''.join(f'{k:>12}' for k in kinds))
+        for jj, count in enumerate(sizes):
+            print(f'{count:>10}' + ''.join(f'{np.median([r[k][jj] for r in chosen]):>12.3e}' for k in kinds))
+
+    outfile = Path(args.output).absolute()
+    with open(outfile, 'wb') as fh:
+        dump((sizes, all_results), fh)
+
+win.Free()
+shared.Free()
@@ -0,0 +1,94 @@
+from itertools import product
+from subprocess import run, PIPE, CalledProcessError
+
+BINDS = ['close', 'spread', 'master']
+PLACES = ['threads', 'cores', 'sockets']
+
+
+def parse_cpus(cpus):
+    ''' OS proc list such as 0-3,8 as [0, 1, 2, 3, 8]
+    '''
+    values = []
+    for part in cpus.split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            values.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            values.append(int(part))
+    return values
+
+
+def cpu_topology():
+    ''' {OS proc: (core, socket)} from `lscpu -p`, empty if unavailable
+    '''
+    try:
+        output = run(['lscpu', '-p=CPU,CORE,SOCKET'], check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
+    except (FileNotFoundError, CalledProcessError):
+        return {}
+    topology = {}
+    for line in output.stdout.split('\n'):
+        if line and not line.startswith('#'):
+            cpu, core, socket = (int(v) if v else -1 for v in line.split(','))
+            topology[cpu] = (core, socket)
+    return topology
+
+
+def node_type():
+    ''' CPU model and socket count, which is what a binding recommendation
+    carries over between
+    '''
+    try:
+        output = run(['lscpu'], check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
+    except (FileNotFoundError, CalledProcessError):
+        return 'unknown'
+    info = dict(line.split(':', 1) for line in output.stdout.split('\n') if ':' in line)
+    return f"{info.get('Model name', 'unknown').strip()} x {info.get('Socket(s)', '1').strip()}"
+
+
+def placement(affinity, topology):
+    ''' Per thread OS procs of a parsed OMP_DISPLAY_AFFINITY report, with
+    the cores and sockets they belong to
+    '''
+    threads = {}
+    for thread, cpus in affinity.items():
+        threads[thread] = {'cpus': cpus,
+                           'cores': sorted({topology[c][0] for c in cpus if c in topology}),
+                           'sockets': sorted({topology[c][1] for c in cpus if c in topology})}
+    return threads
+
+
+def policies(binds=BINDS, places=PLACES, explicit=()):
+    ''' (name, environment) for every OMP_PROC_BIND and OMP_PLACES pair,
+    then each explicit place list bound close
+    '''
+    for bind, place in product(binds, places):
+        yield f'{bind}/{place}', {'OMP_PROC_BIND': bind, 'OMP_PLACES': place}
+    for place in explicit:
+        yield f'close/{place}', {'OMP_PROC_BIND': 'close', 'OMP_PLACES': place}
+
+
+def table(results, kernel='Triad'):
+    ''' Rows of policy name then the kernel's rate at each thread count
+    '''
+    threads = sorted({t for runs in results.values() for t in runs})
+    header = ['policy'] + [str(t) for t in threads]
+    rows = []
+    for name, runs in results.items():
+        rows.append([name] + [runs[t]['kernels'][kernel]['rate'] if t in runs else None for t in threads])
+    return header, rows
+
+
+def recommend(results, kernel='Triad'):
+    ''' Best policy at each thread count, and overall the policy with the
+    highest rate summed over thread counts relative to the best at each
+    '''
+    threads = sorted({t for runs in results.values() for t in runs})
+    best = {}
+    for t in threads:
+        rates = {name: runs[t]['kernels'][kernel]['rate'] for name, runs in results.items() if t in runs}
+        best[t] = max(rates, key=rates.get)
+    score = {}
+    for name, runs in results.items():
+        score[name] = sum(runs[t]['kernels'][kernel]['rate']/results[best[t]][t]['kernels'][kernel]['rate']
+                          for t in threads if t in runs)
+    return {'per_threads': best, 'overall': max(score, key=score.get)}
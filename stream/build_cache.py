@@ -0,0 +1,91 @@
+import json
+import os
+import platform
+import socket
+
+from hashlib import sha256
+from pathlib import Path
+from subprocess import run, PIPE, CalledProcessError
+
+
+def default_cache():
+    ''' Shared cache location, overridable with STREAM_CACHE
+    '''
+    if 'STREAM_CACHE' in os.environ:
+        return Path(os.environ['STREAM_CACHE'])
+    base = os.environ.get('XDG_CACHE_HOME', Path.home()/'.cache')
+    return Path(base)/'system_profiling'/'stream'
+
+
+def compiler_version(compiler):
+    output = run([compiler, '--version'], check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
+    return output.stdout.strip()
+
+
+def native_target(compiler, cflags):
+    ''' What `-march=native` resolves to on this machine, so binaries built
+    for one CPU are never reused on another. Empty if not building native.
+    '''
+    if 'native' not in cflags:
+        return ''
+    try:
+        output = run([compiler, '-march=native', '-Q', '--help=target'],
+                     check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
+        return ' '.join(line.split()[-1] for line in output.stdout.split('\n')
+                        if line.strip().startswith(('-march=', '-mtune=')))
+    except CalledProcessError:
+        # Not gcc-like, fall back to the machine as a whole
+        return platform.processor() or platform.machine()
+
+
+def build_key(source_file, compiler, cflags, defs):
+    ''' Content hash of everything that affects the binary. The -D
+    definitions are sorted so their order does not matter.
+    '''
+    inputs = {'source': sha256(Path(source_file).read_bytes()).hexdigest(),
+              'compiler': compiler_version(compiler),
+              'cflags': cflags.split(),
+              'defs': sorted(defs.split()),
+              'machine': platform.machine(),
+              'native': native_target(compiler, cflags)}
+    return sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:32], inputs
+
+
+def cached_build(source_file, compiler, cflags, defs, cache_dir=None, rebuild=False):
+    ''' Path to a binary of `source_file` built with the given compiler,
+    flags and definitions, compiling only when nothing with the same key is
+    cached.
+
+    Each build goes to a file unique to this host and process and is then
+    renamed into place, which is atomic on the same filesystem. Ranks or
+    nodes racing on shared storage may each compile, but every one of them
+    ends up with a complete binary.
+    '''
+    cache_dir = Path(cache_dir) if cache_dir else default_cache()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key, inputs = build_key(source_file, compiler, cflags, defs)
+    executable_file = cache_dir/f'{Path(source_file).stem}-{key}'
+    if executable_file.exists() and not rebuild:
+        return executable_file
+
+    tmp_file = cache_dir/f'.{executable_file.name}.{socket.gethostname()}.{os.getpid()}'
+    compile_command = [compiler] + cflags.split() + defs.split()
+    compile_command += ['-o', str(tmp_file)]
+    compile_command.append(str(Path(source_file).absolute()))
+    try:
+        run(compile_command, check=True)
+        os.replace(tmp_file, executable_file)
+    except CalledProcessError as e:
+        e.cmd = compile_command
+        raise
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+    # Human readable record of what went into the key
+    meta_file = executable_file.with_suffix('.json')
+    tmp_meta = meta_file.with_name(f'.{meta_file.name}.{socket.gethostname()}.{os.getpid()}')
+    with open(tmp_meta, 'w') as fh:
+        json.dump(inputs, fh, indent=1)
+    os.replace(tmp_meta, meta_file)
+    return executable_file
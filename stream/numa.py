@@ -0,0 +1,73 @@
+import ctypes
+import ctypes.util
+import os
+
+from affinity import parse_cpus
+from pathlib import Path
+from shutil import which
+
+NODE_DIR = Path('/sys/devices/system/node')
+
+
+def numa_nodes():
+    ''' {NUMA node: [OS procs]} for nodes with CPUs, a single node holding
+    every CPU on machines without NUMA information
+    '''
+    nodes = {}
+    for node in sorted(NODE_DIR.glob('node[0-9]*'), key=lambda p: int(p.name[4:])):
+        cpus = parse_cpus((node/'cpulist').read_text().strip())
+        if cpus:
+            nodes[int(node.name[4:])] = cpus
+    return nodes or {0: sorted(os.sched_getaffinity(0))}
+
+
+class Binder(object):
+    ''' Runs a command with threads on one NUMA node and memory on another,
+    interleaved over all nodes, or left to first touch.
+
+    numactl is used when installed. Otherwise libnuma is loaded through
+    ctypes and the policy is set in the child before exec, since both CPU
+    affinity and memory policy survive exec. `method` is None when neither
+    is available.
+    '''
+    def __init__(self):
+        self.method = None
+        self.libnuma = None
+        if which('numactl'):
+            self.method = 'numactl'
+            return
+        name = ctypes.util.find_library('numa')
+        if name:
+            libnuma = ctypes.CDLL(name)
+            if libnuma.numa_available() >= 0:
+                libnuma.numa_parse_nodestring.restype = ctypes.c_void_p
+                libnuma.numa_parse_nodestring.argtypes = (ctypes.c_char_p,)
+                libnuma.numa_set_membind.argtypes = (ctypes.c_void_p,)
+                libnuma.numa_set_interleave_mask.argtypes = (ctypes.c_void_p,)
+                libnuma.numa_bitmask_free.argtypes = (ctypes.c_void_p,)
+                self.libnuma = libnuma
+                self.method = 'libnuma'
+
+    def __call__(self, cpu_node, memory):
+        ''' (command prefix, preexec_fn) placing threads on `cpu_node` with
+        memory on NUMA node `memory`, 'interleave' or 'firsttouch'
+        '''
+        if self.method == 'numactl':
+            prefix = ['numactl', f'--cpunodebind={cpu_node}']
+            if memory == 'interleave':
+                prefix.append('--interleave=all')
+            elif memory != 'firsttouch':
+                prefix.append(f'--membind={memory}')
+            return prefix, None
+
+        def preexec():
+            self.libnuma.numa_run_on_node(cpu_node)
+            if memory == 'firsttouch':
+                return
+            mask = self.libnuma.numa_parse_nodestring(b'all' if memory == 'interleave' else str(memory).encode())
+            if memory == 'interleave':
+                self.libnuma.numa_set_interleave_mask(mask)
+            else:
+                self.libnuma.numa_set_membind(mask)
+            self.libnuma.numa_bitmask_free(mask)
+        return [], preexec
@@ -0,0 +1,142 @@
+import os
+import sys
+
+import numpy as np
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+
+HLINE = '-'*61 + '\n'
+LABELS = ['Copy:      ', 'Scale:     ', 'Add:       ', 'Triad:     ']
+# Bytes moved per element by each kernel, as counted by STREAM
+BYTES = [2*8, 2*8, 3*8, 3*8]
+
+
+class NumpyStream(object):
+    ''' STREAM Copy, Scale, Add and Triad over preallocated NumPy arrays, for
+    when stream.c cannot be compiled.
+
+    Every kernel writes through `out=` so no temporaries are allocated, and
+    the arrays are split into one contiguous chunk per thread. The chunks
+    run on a thread pool, which works because NumPy releases the GIL inside
+    ufunc loops. Triad takes two passes over `a` (multiply then add in
+    place), so it moves more bytes than it is credited with and reads low
+    compared to the compiled kernel.
+
+    Calling an instance returns the same report stream.c prints, so
+    run_stream.parse_stream reads it unchanged. As in stream.c each timing
+    covers `inner` passes and reports the time of one. `command` runs the
+    engine in its own process, so a numactl prefix or a preexec_fn places
+    it exactly as it would the compiled binary.
+    '''
+    def __init__(self, array_size, ntimes=10, scalar=3.0):
+        self.array_size = array_size
+        self.ntimes = ntimes
+        self.scalar = scalar
+
+    def command(self):
+        ''' Command line running this engine as a script, taking the thread
+        count and passes per timing from the environment as stream.c does
+        '''
+        return [sys.executable, str(Path(__file__).absolute()), str(self.array_size), '--ntimes', str(self.ntimes)]
+
+    def __call__(self, threads=1, inner=1):
+        n, scalar = self.array_size, self.scalar
+        a = np.empty(n)
+        b = np.empty(n)
+        c = np.empty(n)
+        bounds = np.linspace(0, n, threads + 1).astype(int)
+        chunks = [slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+        def copy(s):
+            np.copyto(c[s], a[s])
+
+        def scale(s):
+            np.multiply(c[s], scalar, out=b[s])
+
+        def add(s):
+            np.add(a[s], b[s], out=c[s])
+
+        def triad(s):
+            np.multiply(c[s], scalar, out=a[s])
+            np.add(a[s], b[s], out=a[s])
+
+        affinity = [None]*threads
+
+        def init(s):
+            # First touch by the thread that works on the chunk
+            affinity[chunks.index(s)] = sorted(os.sched_getaffinity(0))
+            a[s] = 1.0
+            b[s] = 2.0
+            c[s] = 0.0
+            a[s] *= 2.0
+
+        times = np.zeros((4, self.ntimes))
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(init, chunks))
+            for k in range(self.ntimes):
+                for jj, kernel in enumerate([copy, scale, add, triad]):
+                    t = perf_counter()
+                    for _ in range(inner):
+                        list(pool.map(kernel, chunks))
+                    times[jj, k] = (perf_counter() - t)/inner
+
+        # Placement of each worker in the format run_stream asks OpenMP for
+        report = ''.join(f'level 1 thread {ii} affinity {",".join(str(c) for c in cpus)}\n'
+                         for ii, cpus in enumerate(affinity))
+        report += HLINE
+        report += 'STREAM version NumPy\n'
+        report += HLINE
+        report += f'Array size = {n} (elements), Offset = 0 (elements)\n'
+        report += f'Each kernel will be executed {self.ntimes} times.\n'
+        report += f'Each timing covers {inner} passes over the arrays.\n'
+        report += f'Number of Threads counted = {threads}\n'
+        report += HLINE
+        report += 'Your clock granularity appears to be less than one microsecond.\n'
+        report += HLINE
+        report += 'Function    Best Rate MB/s  Avg time     Min time     Max time\n'
+        # The first iteration is left out, as in STREAM
+        timed = times[:, 1:] if self.ntimes > 1 else times
+        for label, nbytes, t in zip(LABELS, BYTES, timed):
+            rate = 1.0E-06*nbytes*n/t.min()
+            report += f'{label}{rate:12.1f}  {t.mean():11.6f}  {t.min():11.6f}  {t.max():11.6f}\n'
+        report += HLINE
+        report += self.validate(a, b, c)
+        report += HLINE
+        return report
+
+    def validate(self, a, b, c, epsilon=1.e-13):
+        ''' Same check as checkSTREAMresults in stream.c
+        '''
+        aj, bj, cj = 2.0, 2.0, 0.0
+        for _ in range(self.ntimes):
+            cj = aj
+            bj = self.scalar*cj
+            cj = aj + bj
+            aj = bj + self.scalar*cj
+        errors = [np.mean(np.abs(x - xj))/abs(xj) for x, xj in [(a, aj), (b, bj), (c, cj)]]
+        for name, err in zip('abc', errors):
+            if err > epsilon:
+                return f'Failed Validation on array {name}[], AvgRelAbsErr > epsilon ({epsilon:e})\n'
+        return f'Solution Validates: avg error less than {epsilon:e} on all three arrays\n'
+
+
+def calibrate(compiled, array_size, ntimes, threads, run_env, run_stream):
+    ''' Ratio of NumPy to compiled STREAM rate for every kernel, against the
+    `compiled` record of a run at the same array size and thread count
+    '''
+    python = run_stream(NumpyStream(array_size, ntimes), threads, run_env)
+    return {k: python['kernels'][k]['rate']/compiled['kernels'][k]['rate'] for k in compiled['kernels']}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('array_size', type=int)
+    parser.add_argument('--ntimes', type=int, default=10)
+    args, _ = parser.parse_known_args()
+
+    threads = int(os.environ.get('OMP_NUM_THREADS', 1))
+    inner = int(os.environ.get('STREAM_INNER', 1))
+    print(NumpyStream(args.array_size, args.ntimes)(threads, inner), end='')
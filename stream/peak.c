@@ -0,0 +1,88 @@
+/*-----------------------------------------------------------------------*/
+/* Program: peak                                                         */
+/* Peak double precision FLOP rate from independent fused multiply-add   */
+/* chains, sized to fit in registers, run on every OpenMP thread.        */
+/*                                                                       */
+/* Compile with the same flags as STREAM, for example                    */
+/*   gcc -march=native -O3 -fopenmp -ffast-math -o peak peak.c           */
+/* and check the loop vectorised with -fopt-info-vec if the rate is low. */
+/*-----------------------------------------------------------------------*/
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/time.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+/* Independent accumulators, enough to cover FMA latency times the
+ * number of FMA units for any current vector width */
+#ifndef CHAINS
+#define CHAINS 64
+#endif
+
+#ifndef NTIMES
+#define NTIMES 10
+#endif
+
+#ifndef ITERATIONS
+#define ITERATIONS 2000000
+#endif
+
+double mysecond()
+{
+    struct timeval tp;
+    gettimeofday(&tp, NULL);
+    return ((double) tp.tv_sec + (double) tp.tv_usec * 1.e-6);
+}
+
+int main(int argc, char *argv[])
+{
+    int threads = 1;
+    double times[NTIMES];
+    double checksum = 0.0;
+
+#pragma omp parallel
+#pragma omp master
+    {
+#ifdef _OPENMP
+        threads = omp_get_num_threads();
+#endif
+    }
+
+    for (int k = 0; k < NTIMES; k++) {
+        double t = mysecond();
+#pragma omp parallel reduction(+:checksum)
+        {
+            double x[CHAINS];
+            /* Values the compiler cannot fold away, kept close to 1 */
+            const double a = 1.0 + 1.0e-9 * (argc + 1);
+            const double b = 1.0e-9;
+            for (int j = 0; j < CHAINS; j++)
+                x[j] = 1.0 + j * 1.0e-6;
+            for (long i = 0; i < ITERATIONS; i++) {
+#pragma omp simd
+                for (int j = 0; j < CHAINS; j++)
+                    x[j] = x[j] * a + b;
+            }
+            for (int j = 0; j < CHAINS; j++)
+                checksum += x[j];
+        }
+        times[k] = mysecond() - t;
+    }
+
+    /* 2 FLOPs per FMA, first iteration excluded as in STREAM */
+    double flops = 2.0 * CHAINS * (double) ITERATIONS * threads;
+    double best = times[NTIMES > 1 ? 1 : 0], avg = 0.0, worst = 0.0;
+    for (int k = NTIMES > 1 ? 1 : 0; k < NTIMES; k++) {
+        best = times[k] < best ? times[k] : best;
+        worst = times[k] > worst ? times[k] : worst;
+        avg += times[k];
+    }
+    avg /= (NTIMES > 1 ? NTIMES - 1 : 1);
+
+    printf("Number of Threads counted = %i\n", threads);
+    printf("Function    Best Rate GFLOP/s  Avg time     Min time     Max time\n");
+    printf("FMA:       %12.3f  %11.6f  %11.6f  %11.6f\n", 1.0e-9 * flops / best, avg, best, worst);
+    printf("Checksum: %f\n", checksum);
+    return 0;
+}
@@ -4,7 +4,7 @@ import matplotlib.pyplot as plt
 from argparse import ArgumentParser
 from pathlib import Path
 from pickle import load
-from run_stream import size2val
+from run_stream import KERNELS, size2val
 
 parser = ArgumentParser()
 parser.add_argument('--channels', type=int, default=None)
@@ -12,13 +12,130 @@ parser.add_argument('-i', '--input', default='results.pickle')
 parser.add_argument('-o', '--output')
 parser.add_argument('--single_channel', type=str, default=None)
 parser.add_argument('-t', '--title', type=str, default=None)
+parser.add_argument('-k', '--kernel', nargs='+', choices=KERNELS + ['all'], default=['Triad'])
+parser.add_argument('-s', '--statistic', choices=['rate', 'avg', 'min', 'max'], default='rate',
+                    help='Best rate, or average, min or max time per iteration')
 args, _ = parser.parse_known_args()
 
 inputfile = Path(args.input).absolute()
 with open(inputfile, 'rb') as fh:
     results = load(fh)
 
-cores = [ii + 1 for ii in range(len(results))]
+DPI = 300
+kernels = KERNELS if 'all' in args.kernel else args.kernel
+mode = results.get('mode') if isinstance(results, dict) else None
+ylabel = 'Rate GB/s' if args.statistic == 'rate' else f'{args.statistic.capitalize()} time (s)'
+
+
+def value(record, kernel):
+    v = record['kernels'][kernel][args.statistic]
+    return v/(2**10) if args.statistic == 'rate' else v
+
+
+def save(fig):
+    plt_name = Path(args.output).absolute() if args.output else inputfile.with_suffix('.png')
+    fig.savefig(plt_name, bbox_inches='tight', dpi=DPI)
+    plt.show()
+
+if mode == 'sweep':
+    # Bandwidth against working set, one curve per thread count and kernel
+    fig, ax = plt.subplots(1, 1)
+    fig.set_size_inches((10, 8))
+    for ii, (threads, records) in enumerate(results['records'].items()):
+        x = np.array([r['working_set'] for r in records])
+        good = np.array([r['reliable'] for r in records])
+        for jj, kernel in enumerate(kernels):
+            y = np.array([r['kernels'][kernel][args.statistic] for r in records])
+            y = y/(2**10) if args.statistic == 'rate' else y
+            style = ['x-', 'o--', 's-.', 'd:'][jj % 4]
+            ax.plot(x[good], y[good], style, color=f'C{ii}', label=f'{threads} threads {kernel}')
+            ax.plot(x[~good], y[~good], '.', color=f'C{ii}', alpha=0.3)
+        for knee in results['hierarchy'].get(threads, {}).get('knees', []):
+            ax.axvline(knee, color=f'C{ii}', ls=':', lw=0.8)
+    # Cache capacity the threads of each curve can use, older sweeps only hold the totals
+    capacities = results.get('capacities', {t: results['caches'] for t in results['records']})
+    for ii, (threads, reach) in enumerate(capacities.items()):
+        for name, capacity in reach.items():
+            ax.axvline(capacity, color=f'C{ii}', ls='--', lw=0.8)
+            ax.annotate(f'{name} ({threads})', (capacity, 1), xycoords=('data', 'axes fraction'),
+                        ha='right', va='top', rotation=90)
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('Working set (bytes)')
+    ax.set_ylabel(ylabel)
+    ax.set_title(str(args.title) if args.title else 'Streams working set sweep')
+    ax.legend()
+    save(fig)
+    exit(0)
+
+if mode == 'affinity':
+    # Thread scaling, one curve per binding policy and kernel
+    fig, ax = plt.subplots(1, 1)
+    fig.set_size_inches((10, 8))
+    for ii, (name, runs) in enumerate(results['records'].items()):
+        threads = sorted(runs)
+        for jj, kernel in enumerate(kernels):
+            style = ['x-', 'o--', 's-.', 'd:'][jj % 4]
+            ax.plot(threads, [value(runs[t], kernel) for t in threads], style, color=f'C{ii}', label=f'{name} {kernel}')
+    ax.set_xlabel('Threads')
+    ax.set_ylabel(ylabel)
+    ax.set_title(str(args.title) if args.title else f'Streams binding policies on {results["node_type"]}')
+    ax.legend()
+    save(fig)
+    exit(0)
+
+if mode == 'numa':
+    # Threads on the row node, memory on the column node, first touch or interleaved
+    nodes = results['nodes']
+    columns = nodes + ['firsttouch', 'interleave']
+    fig, axes = plt.subplots(1, len(kernels), squeeze=False)
+    fig.set_size_inches((6*len(kernels), 5))
+    for ax, kernel in zip(axes[0], kernels):
+        matrix = np.array([[value(results['records'][(i, j)], kernel) if (i, j) in results['records'] else np.nan
+                            for j in columns] for i in nodes])
+        im = ax.imshow(matrix, interpolation='nearest')
+        for (i, j), v in np.ndenumerate(matrix):
+            if np.isfinite(v):
+                ax.annotate(f'{v:.3g}', (j, i), ha='center', va='center', color='w')
+        fig.colorbar(im, ax=ax, label=ylabel, shrink=0.8)
+        ax.set_xticks(range(len(columns)), [str(c) for c in columns])
+        ax.set_yticks(range(len(nodes)), [str(i) for i in nodes])
+        ax.set_xlabel('Memory node')
+        ax.set_ylabel('CPU node')
+        ax.set_title(kernel)
+    fig.suptitle(str(args.title) if args.title else f'Streams NUMA bandwidth ({results["method"]})')
+    save(fig)
+    exit(0)
+
+if mode == 'mpi':
+    # Thread scaling of every node, outliers drawn over the rest
+    outliers = {o['node'] for o in results['outliers']}
+    fig, axes = plt.subplots(1, len(kernels), squeeze=False)
+    fig.set_size_inches((8*len(kernels), 8))
+    for ax, kernel in zip(axes[0], kernels):
+        for node, records in results['records'].items():
+            threads = [r.get('threads', ii + 1) for ii, r in enumerate(records)]
+            if node in outliers:
+                ax.plot(threads, [value(r, kernel) for r in records], 'x-', lw=2, label=node, zorder=3)
+            else:
+                ax.plot(threads, [value(r, kernel) for r in records], '-', color='0.6', alpha=0.5)
+        ax.set_xlabel('Cores')
+        ax.set_ylabel(ylabel)
+        ax.set_title(kernel)
+        if outliers:
+            ax.legend()
+    fig.suptitle(str(args.title) if args.title else f'Streams on {len(results["nodes"])} nodes, {len(outliers)} outliers')
+    save(fig)
+    exit(0)
+
+if results and not isinstance(results[0], dict):
+    # Older results only hold the Triad rate
+    results = [{'threads': ii + 1, 'kernels': {'Triad': {'rate': r}}} for ii, r in enumerate(results)]
+    kernels = ['Triad']
+    args.statistic = 'rate'
+series = {k: np.array([r['kernels'][k][args.statistic] for r in results]) for k in kernels}
+
+cores = [r.get('threads', ii + 1) for ii, r in enumerate(results)]
 if args.channels:
     channels = [ii + 1 for ii in range(args.channels)]
 else:
@@ -26,28 +143,30 @@ else:
 if args.single_channel:
     single_channel = size2val(args.single_channel)
 else:
-    single_channel = results[0]
+    single_channel = series[kernels[-1]][0]
 
 
-DPI = 300
 fig, ax = plt.subplots(1, 1)
 fig.set_size_inches((8, 8))
 
-perfect = [c*single_channel/(2**30) for c in channels]
-# ~ ax.plot([0], [0], 'ko')
-ax.plot(channels, perfect, 'k:')
-ax.plot([channels[-1], cores[-1]], [perfect[-1], perfect[-1]], 'k:')
-ax.plot(cores, results/(2**10), 'x-')
+if args.statistic == 'rate':
+    perfect = [c*single_channel/(2**30) for c in channels]
+    # ~ ax.plot([0], [0], 'ko')
+    ax.plot(channels, perfect, 'k:')
+    ax.plot([channels[-1], cores[-1]], [perfect[-1], perfect[-1]], 'k:')
+    for kernel, values in series.items():
+        ax.plot(cores, values/(2**10), 'x-', label=kernel)
+    ax.set_ylabel('Rate GB/s')
+else:
+    for kernel, values in series.items():
+        ax.plot(cores, values, 'x-', label=kernel)
+    ax.set_ylabel(f'{args.statistic.capitalize()} time (s)')
+if len(series) > 1:
+    ax.legend()
 if args.title:
     ax.set_title(str(args.title))
 else:
     ax.set_title('Streams')
 ax.set_xlabel('Cores')
-ax.set_ylabel('Rate GB/s')
 
-if args.output:
-    plt_name = Path(args.output).absolute()
-else:
-    plt_name = inputfile.with_suffix('.png')
-fig.savefig(plt_name, bbox_inches='tight', dpi=DPI)
-plt.show()
+save(fig)
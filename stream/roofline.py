@@ -0,0 +1,166 @@
+import json
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from argparse import ArgumentParser
+from build_cache import cached_build
+from os import environ
+from pathlib import Path
+from pickle import dump, load
+from run_stream import guess_cores
+from subprocess import run, PIPE, CalledProcessError
+
+
+def parse_peak(stdout):
+    for line in stdout.split('\n'):
+        if line.startswith('FMA:'):
+            rate, avg, tmin, tmax = (float(v) for v in line.split()[1:5])
+            return {'gflops': rate, 'avg': avg, 'min': tmin, 'max': tmax}
+    raise ValueError('No FMA line in peak output')
+
+
+def measure_peak(threads, cc='gcc', cflags='-march=native -O3 -fopenmp -ffast-math', cache=None):
+    ''' Peak GFLOP/s of the FMA microbenchmark at each thread count
+    '''
+    executable_file = cached_build(Path('peak.c').absolute(), cc, cflags, '', cache_dir=cache)
+    run_env = environ.copy()
+    results = []
+    for t in threads:
+        run_env['OMP_NUM_THREADS'] = str(t)
+        output = run([executable_file], env=run_env, check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
+        record = parse_peak(output.stdout)
+        record['threads'] = t
+        results.append(record)
+        print('Threads:', t, 'Peak:', record['gflops'], 'GFLOP/s')
+    return results
+
+
+def ceilings(stream_results, threads=None):
+    ''' Bandwidth ceilings in GB/s from run_stream results, each cache level
+    found by a working set sweep and DRAM, at `threads` or the most threads
+    measured. Sweeps that found no levels give DRAM alone, from the largest
+    working set.
+    '''
+    mode = stream_results.get('mode') if isinstance(stream_results, dict) else None
+    if mode == 'numa':
+        raise ValueError('--numa results hold bandwidth between pairs of NUMA nodes, not of the whole node,'
+                         ' use thread scaling, --sweep or --affinity results')
+    if mode == 'mpi':
+        raise ValueError('--mpi results hold thread scaling of many nodes, rerun run_stream.py on one node')
+    if mode == 'sweep':
+        hierarchy = stream_results['hierarchy']
+        if hierarchy:
+            t = threads if threads in hierarchy else max(hierarchy)
+            levels = hierarchy[t]['levels']
+            names = list(hierarchy[t].get('caches', []))
+            # Levels run from the smallest working set, the last one is DRAM
+            names = [f'{n} level' if n else f'Level {ii + 1}' for ii, n in enumerate(names)] + ['DRAM']
+            return {name: level['rate']/1e3 for name, level in zip(names, levels)}
+        records = stream_results['records']
+        t = threads if threads in records else max(records)
+        return {'DRAM': records[t][-1]['kernels']['Triad']['rate']/1e3}
+    if mode == 'affinity':
+        stream_results = [r for runs in stream_results['records'].values() for r in runs.values()]
+    records = [r for r in stream_results if threads is None or r.get('threads') == threads] or stream_results
+    return {'DRAM': max(r['kernels']['Triad']['rate'] for r in records)/1e3}
+
+
+def parse_kernels(specs):
+    ''' Application kernels given as name:intensity[:GFLOP/s] or a JSON file
+    of [{"name": ..., "intensity": ..., "gflops": ...}]
+    '''
+    kernels = []
+    for spec in specs:
+        if spec.endswith('.json'):
+            with open(spec) as fh:
+                kernels.extend(json.load(fh))
+            continue
+        name, intensity, *perf = spec.split(':')
+        kernels.append({'name': name, 'intensity': float(intensity), 'gflops': float(perf[0]) if perf else None})
+    return kernels
+
+
+def roofline(peak, bandwidths, kernels, title=None):
+    ''' Roofline chart, attainable GFLOP/s against arithmetic intensity in
+    FLOP/byte for every bandwidth ceiling under the compute peak
+    '''
+    intensities = [k['intensity'] for k in kernels]
+    ridge = [peak/bw for bw in bandwidths.values()]
+    lo = min(intensities + ridge + [1])/8
+    hi = max(intensities + ridge + [1])*8
+    x = np.geomspace(lo, hi, 256)
+
+    fig, ax = plt.subplots(1, 1)
+    fig.set_size_inches((10, 8))
+    ax.plot([lo, hi], [peak, peak], 'k-', lw=2)
+    ax.annotate(f'Peak {peak:.1f} GFLOP/s', (hi, peak), ha='right', va='bottom')
+    for ii, (name, bw) in enumerate(bandwidths.items()):
+        ax.plot(x, np.minimum(peak, bw*x), '-', color=f'C{ii}', label=f'{name} {bw:.1f} GB/s')
+    for k in kernels:
+        bound = min(peak, min(bandwidths.values())*k['intensity'])
+        ax.plot([k['intensity']]*2, [lo*min(bandwidths.values()), bound], 'k:', lw=0.8)
+        if k.get('gflops'):
+            ax.plot(k['intensity'], k['gflops'], 'o')
+            ax.annotate(k['name'], (k['intensity'], k['gflops']), xytext=(4, 4), textcoords='offset points')
+        else:
+            ax.plot(k['intensity'], bound, 'kx')
+            ax.annotate(k['name'], (k['intensity'], bound), xytext=(4, -12), textcoords='offset points')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlim(lo, hi)
+    ax.set_xlabel('Arithmetic intensity (FLOP/byte)')
+    ax.set_ylabel('GFLOP/s')
+    ax.set_title(str(title) if title else 'Roofline')
+    ax.legend()
+    return fig
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--stream', default='results.pickle', help='run_stream.py results, a working set sweep gives cache ceilings')
+    parser.add_argument('-p', '--peak', default='peak.pickle', help='Peak FLOP results, measured and written here if missing')
+    parser.add_argument('--measure', action='store_true', help='Measure the peak even if results exist')
+    parser.add_argument('-c', '--cores', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None, help='Thread count to draw, the most measured by default')
+    parser.add_argument('--cc', type=str, default='gcc')
+    parser.add_argument('--cflags', type=str, default='-march=native -O3 -fopenmp -ffast-math')
+    parser.add_argument('--cache', type=str, default=None)
+    parser.add_argument('-k', '--kernels', nargs='+', default=[],
+                        help='Application kernels as name:intensity[:GFLOP/s], or JSON files of them')
+    parser.add_argument('-o', '--output', default='roofline.png')
+    parser.add_argument('-t', '--title', type=str, default=None)
+    args, _ = parser.parse_known_args()
+
+    peak_file = Path(args.peak).absolute()
+    if args.measure or not peak_file.exists():
+        cores = args.cores or guess_cores()
+        try:
+            peaks = measure_peak(range(1, cores + 1), args.cc, args.cflags, args.cache)
+        except CalledProcessError as e:
+            print('Building or running peak.c failed:', e)
+            exit(1)
+        with open(peak_file, 'wb') as fh:
+            dump(peaks, fh)
+    else:
+        with open(peak_file, 'rb') as fh:
+            peaks = load(fh)
+
+    with open(Path(args.stream).absolute(), 'rb') as fh:
+        stream_results = load(fh)
+
+    chosen = [p for p in peaks if p['threads'] == args.threads] or [max(peaks, key=lambda p: p['threads'])]
+    peak = chosen[0]['gflops']
+    try:
+        bandwidths = ceilings(stream_results, chosen[0]['threads'])
+    except ValueError as e:
+        print('Cannot draw a roofline from', args.stream + ':', e)
+        exit(1)
+    kernels = parse_kernels(args.kernels)
+    for k in kernels:
+        bw = min(bandwidths.values())
+        bound = 'memory' if bw*k['intensity'] < peak else 'compute'
+        print(f"{k['name']}: attainable {min(peak, bw*k['intensity']):.1f} GFLOP/s, {bound} bound at DRAM bandwidth")
+
+    fig = roofline(peak, bandwidths, kernels, title=args.title)
+    fig.savefig(Path(args.output).absolute(), bbox_inches='tight', dpi=300)
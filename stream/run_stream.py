@@ -1,8 +1,23 @@
+import re
+
+import numpy as np
+
+from time import sleep
+
+from affinity import BINDS, PLACES, cpu_topology, node_type, parse_cpus, placement, policies, recommend, table
 from argparse import ArgumentParser
-from os import environ
+from build_cache import cached_build
+from numa import Binder, numa_nodes
+from numpy_stream import NumpyStream, calibrate
+from os import cpu_count, environ, sched_getaffinity, sched_setaffinity
 from pathlib import Path
 from pickle import dump
 from subprocess import run, PIPE, CalledProcessError
+from sweep import cache_reach, inner_passes, nearest_cache, plateaus, reliable, working_sets
+
+KERNELS = ['Copy', 'Scale', 'Add', 'Triad']
+# Parsed back by parse_affinity, %A is the list of OS procs a thread may use
+AFFINITY_FORMAT = 'level %L thread %n affinity %A'
 
 def guess_cores():
     try:
@@ -28,15 +43,25 @@ def size2val(size):
     return value
 
 
+def guess_caches(column='ALL-SIZE'):
+    ''' Size in bytes of each data cache level, {'L1d': ..., 'L2': ...},
+    totalled over every instance or of one instance with `ONE-SIZE`
+    '''
+    output = run(['lscpu', '-C'], check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
+    lines = [s.split() for s in output.stdout.split('\n') if s]
+    header = lines[0]
+    caches = {}
+    for line in lines[1:]:
+        row = dict(zip(header, line))
+        if row.get('TYPE') != 'Instruction':
+            caches[row['NAME']] = size2val(row[column])
+    return caches
+
+
 def guess_l3():
     try:
-        output = run(['lscpu', '-C'], check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
-        for s in reversed(output.stdout.split('\n')):
-            if s:
-                cache = s
-                break
-        size = cache.split()[2]
-        l3 = units2val(size)
+        caches = guess_caches()
+        l3 = caches[sorted(caches)[-1]]
     except FileNotFoundError:
         print('No command `lscpu`, using default value of 20MB for L3 cache size')
         l3 = 20*2**20
@@ -46,6 +71,341 @@ def guess_l3():
     return l3
 
 
+def parse_affinity(text):
+    ''' {thread number: [OS procs]} from OMP_DISPLAY_AFFINITY lines printed
+    with AFFINITY_FORMAT
+    '''
+    affinity = {}
+    for match in re.finditer(r'^level (\d+) thread (\d+) affinity (\S+)', text, re.MULTILINE):
+        affinity[int(match.group(2))] = parse_cpus(match.group(3))
+    return dict(sorted(affinity.items()))
+
+
+def parse_stream(stdout, stderr=''):
+    ''' Structured record of one STREAM run: best rate (MB/s) and
+    avg/min/max times (s) of every kernel, the validation outcome and the
+    affinity of each thread
+    '''
+    record = {'kernels': {}, 'validated': False, 'validation': None}
+    for line in stdout.split('\n'):
+        label = line.split(':')[0]
+        if label in KERNELS:
+            rate, avg, tmin, tmax = (float(v) for v in line.split()[1:5])
+            record['kernels'][label] = {'rate': rate, 'avg': avg, 'min': tmin, 'max': tmax}
+        elif line.startswith('Solution Validates'):
+            record['validated'] = True
+            record['validation'] = line.strip()
+        elif line.startswith('Failed Validation') and record['validation'] is None:
+            record['validation'] = line.strip()
+        elif line.startswith('Number of Threads counted'):
+            record['threads'] = int(line.split('=')[1])
+        elif line.startswith('Your clock granularity'):
+            match = re.search(r'(\d+) microseconds', line)
+            record['granularity'] = 1e-6*int(match.group(1)) if match else 1e-6
+        elif line.startswith('Array size'):
+            record['array_size'] = int(line.split('=')[1].split()[0])
+        elif line.startswith('Each timing covers'):
+            record['inner'] = int(line.split()[3])
+    # Affinity goes to stderr with libgomp, stdout with some other runtimes
+    record['affinity'] = parse_affinity(stdout + '\n' + stderr)
+    return record
+
+
+def build(array_size, args):
+    ''' STREAM binary for `array_size` elements, from the build cache unless
+    `--no_compile`, or the NumPy engine if asked for or compiling fails
+    '''
+    if args.engine == 'numpy':
+        return NumpyStream(array_size, args.repeats)
+    pp_defs = f'-DSTREAM_ARRAY_SIZE={array_size} -DNTIMES={args.repeats} -DOFFSET={args.offset}'
+    source_file = Path('stream.c').absolute()
+
+    if args.no_compile:
+        executable_file = source_file.with_suffix('')
+        print(f'Using {executable_file}, which may not match {pp_defs}')
+        return executable_file
+    try:
+        return cached_build(source_file, args.cc, args.cflags, pp_defs,
+                            cache_dir=args.cache, rebuild=args.rebuild)
+    except FileNotFoundError:
+        print(f'No compiler `{args.cc}`, falling back to the NumPy STREAM engine')
+        return NumpyStream(array_size, args.repeats)
+    except CalledProcessError as e:
+        print('Executing:')
+        print(' '.join(e.cmd))
+        print('failed, try compiling manually and pass `--no_compile` argument')
+        print('If running on a system with large L3 cache you may need to add')
+        print('`-mcmodel=medium` or even `-mcmodel=large` to default `--cflags`')
+        print('Falling back to the NumPy STREAM engine')
+        return NumpyStream(array_size, args.repeats)
+
+
+def stream_env():
+    run_env = environ.copy()
+    run_env['OMP_DISPLAY_AFFINITY'] = 'TRUE'
+    run_env['OMP_AFFINITY_FORMAT'] = AFFINITY_FORMAT
+    return run_env
+
+
+def run_stream(executable_file, threads, run_env, prefix=(), preexec_fn=None):
+    ''' Record of one STREAM run on `threads` threads, optionally under a
+    placement command `prefix` or `preexec_fn`, which apply to the NumPy
+    engine as well since it runs in its own process
+    '''
+    command = executable_file.command() if isinstance(executable_file, NumpyStream) else [executable_file]
+    run_env['OMP_NUM_THREADS'] = str(threads)
+    output = run([*prefix, *command], env=run_env, check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8',
+                 preexec_fn=preexec_fn)
+    record = parse_stream(output.stdout, output.stderr)
+    record['threads'] = threads
+    return record
+
+
+def sweep(args, cores, caches, totals):
+    ''' Bandwidth of every kernel against working set for each thread
+    count, with the plateaus and knees of the Triad curve matched against
+    the cache capacity those threads can use. `caches` holds the size of
+    one instance of each level and `totals` the sum over all of them.
+    '''
+    # Start in L1, a typical 32KiB L1d when lscpu gave no sizes, never from
+    # an L3 passed with `-l3` which is no in-cache lower bound
+    l1 = [v for k, v in caches.items() if k.startswith('L1')]
+    smallest = size2val(args.min_size) if args.min_size else min(l1, default=32*2**10)//2
+    largest = size2val(args.max_size) if args.max_size else 4*max(totals.values())
+    sets, array_sizes = working_sets(smallest, largest, args.points)
+    threads = args.threads or sorted({1, cores})
+    run_env = stream_env()
+    # Binaries are built once per array size and reused for every thread count
+    records = {t: [] for t in threads}
+    for working_set, array_size in zip(sets, array_sizes):
+        executable_file = build(array_size, args)
+        for t in threads:
+            # Small working sets are swept many times per timing to beat the clock
+            run_env['STREAM_INNER'] = str(inner_passes(working_set, t))
+            record = run_stream(executable_file, t, run_env)
+            record['working_set'] = working_set
+            record['reliable'] = reliable(record)
+            records[t].append(record)
+            print('Working set:', working_set, 'Threads:', t,
+                  'Rate:', record['kernels']['Triad']['rate'], 'MB/s',
+                  '' if record['reliable'] else '(under 20 clock ticks)')
+
+    capacities = {t: cache_reach(caches, totals, t, cores) for t in threads}
+    hierarchy = {}
+    for t, recs in records.items():
+        # Timings below the clock resolution would show up as false levels
+        good = [r for r in recs if r['reliable']]
+        if len(good) < 2:
+            continue
+        hierarchy[t] = plateaus([r['working_set'] for r in good],
+                                [r['kernels']['Triad']['rate'] for r in good])
+        hierarchy[t]['caches'] = [nearest_cache(k, capacities[t]) for k in hierarchy[t]['knees']]
+        print(f'Threads: {t}')
+        for level in hierarchy[t]['levels']:
+            print(f"  {level['smallest']:12.4g} - {level['largest']:12.4g} bytes: {level['rate']:10.1f} MB/s")
+        for knee, cache in zip(hierarchy[t]['knees'], hierarchy[t]['caches']):
+            print(f'  knee at {knee:12.4g} bytes, closest to {cache} ({capacities[t].get(cache, 0)} bytes)')
+    return {'mode': 'sweep',
+            'caches': caches,
+            'totals': totals,
+            'capacities': capacities,
+            'working_sets': sets,
+            'threads': threads,
+            'records': records,
+            'hierarchy': hierarchy}
+
+
+def affinity_sweep(args, cores, executable_file):
+    ''' Rate of every kernel for each binding policy and thread count, with
+    where each thread actually ran
+    '''
+    topology = cpu_topology()
+    threads = args.threads or sorted({1, cores//2 or 1, cores})
+    results = {}
+    for name, env in policies(args.bind, args.places, args.place_list):
+        run_env = stream_env()
+        run_env.update(env)
+        results[name] = {}
+        for t in threads:
+            record = run_stream(executable_file, t, run_env)
+            record['placement'] = placement(record['affinity'], topology)
+            results[name][t] = record
+
+    header, rows = table(results)
+    width = max(len(r[0]) for r in rows) + 2
+    print('Triad MB/s'.ljust(width) + ''.join(f'{h:>12}' for h in header[1:]))
+    for row in rows:
+        print(row[0].ljust(width) + ''.join(f'{v:>12.1f}' if v is not None else f'{"-":>12}' for v in row[1:]))
+    best = recommend(results)
+    kind = node_type()
+    for t, name in best['per_threads'].items():
+        print(f'{t} threads: {name}')
+    print(f'Recommended for {kind}: {best["overall"]}')
+    return {'mode': 'affinity',
+            'node_type': kind,
+            'threads': threads,
+            'table': [header] + rows,
+            'recommended': best,
+            'records': results}
+
+
+def numa_sweep(args, executable_file):
+    ''' Rate with threads on NUMA node i and memory on node j, plus first
+    touch and interleaved memory for threads on each node
+    '''
+    nodes = numa_nodes()
+    binder = Binder()
+    run_env = stream_env()
+    run_env['OMP_PROC_BIND'] = 'true'
+    if len(nodes) < 2 or binder.method is None:
+        reason = 'one NUMA node' if len(nodes) < 2 else 'neither numactl nor libnuma'
+        print(f'Found {reason}, reporting a single first touch result')
+        record = run_stream(executable_file, args.threads[0] if args.threads else len(nodes[min(nodes)]), run_env)
+        rate = record['kernels']['Triad']['rate']
+        return {'mode': 'numa', 'method': None, 'nodes': list(nodes),
+                'matrix': [[rate]], 'firsttouch': [rate], 'interleave': [None], 'records': {(0, 'firsttouch'): record}}
+
+    names = list(nodes)
+    records = {}
+    for i in names:
+        # Fill the node, unless told otherwise
+        threads = args.threads[0] if args.threads else len(nodes[i])
+        for memory in names + ['firsttouch', 'interleave']:
+            prefix, preexec_fn = binder(i, memory)
+            records[(i, memory)] = run_stream(executable_file, threads, run_env, prefix, preexec_fn)
+
+    def rate(i, memory):
+        return records[(i, memory)]['kernels']['Triad']['rate']
+
+    matrix = [[rate(i, j) for j in names] for i in names]
+    print(f'Triad MB/s, threads on row node, memory on column node ({binder.method})')
+    print(f'{"":>8}' + ''.join(f'{j:>12}' for j in names) + f'{"first":>12}{"interleave":>12}')
+    for i, row in zip(names, matrix):
+        print(f'{i:>8}' + ''.join(f'{v:>12.1f}' for v in row)
+              + f'{rate(i, "firsttouch"):>12.1f}{rate(i, "interleave"):>12.1f}')
+    return {'mode': 'numa',
+            'method': binder.method,
+            'nodes': names,
+            'matrix': matrix,
+            'firsttouch': [rate(i, 'firsttouch') for i in names],
+            'interleave': [rate(i, 'interleave') for i in names],
+            'records': records}
+
+
+def thread_scaling(args, cores, executable_file, array_size, verbose=True):
+    ''' Record of a STREAM run at every thread count from 1 to `cores`
+    '''
+    run_env = stream_env()
+    results = []
+    for ii in range(cores):
+        record = run_stream(executable_file, ii + 1, run_env)
+        if args.calibrate and not isinstance(executable_file, NumpyStream):
+            record['calibration'] = calibrate(record, array_size, args.repeats, ii + 1, run_env, run_stream)
+            if verbose:
+                print('NumPy/compiled:', ', '.join(f'{k} {v:.2f}' for k, v in record['calibration'].items()))
+        results.append(record)
+        if verbose:
+            print('Cores:', ii + 1, 'Rate:', record['kernels']['Triad']['rate'], 'MB/s',
+                  '' if record['validated'] else '(failed validation)')
+            print('Affinity:', record['affinity'])
+    return results
+
+
+def unbind():
+    ''' Widen this process's affinity to every online CPU, so STREAM started
+    from it is not held to the core or package an MPI launcher bound the
+    rank to. Returns the CPUs now allowed, fewer than all of them when a
+    cpuset still restricts the process.
+    '''
+    try:
+        online = parse_cpus(Path('/sys/devices/system/cpu/online').read_text().strip())
+    except FileNotFoundError:
+        online = range(cpu_count())
+    try:
+        sched_setaffinity(0, online)
+    except OSError:
+        pass
+    return sched_getaffinity(0)
+
+
+def node_screen(args, cores):
+    ''' Thread scaling on every node of an MPI job at once, one leader rank
+    per node, gathered on rank 0 with the cluster aggregate and per node
+    outliers. Returns None on every other rank.
+    '''
+    from mpi4py import MPI
+
+    comm = MPI.COMM_WORLD
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.rank)
+    # Other ranks on a node stay idle so they do not compete for bandwidth
+    leaders = comm.Split(0 if node.rank == 0 else MPI.UNDEFINED, key=comm.rank)
+    summary = None
+    if node.rank == 0:
+        # Children inherit the leader's affinity, which mpirun usually bound
+        # to one core or package
+        allowed = unbind()
+        if len(allowed) < cpu_count():
+            print(f'{MPI.Get_processor_name()}: STREAM can only use {len(allowed)} of {cpu_count()} CPUs,'
+                  ' launch with `--bind-to none` (or your launcher\'s equivalent)', flush=True)
+        l3 = size2val(args.l3) if args.l3 else guess_l3()
+        # Leaders building at once is safe, the cache renames into place
+        executable_file = build(l3//2, args)
+        leaders.Barrier()
+        records = thread_scaling(args, cores, executable_file, l3//2, verbose=False)
+        gathered = leaders.gather((MPI.Get_processor_name(), records), root=0)
+        if leaders.rank == 0:
+            summary = screen(gathered, args.zscore)
+    # A blocking barrier would spin on the cores the leader's threads run on
+    request = comm.Ibarrier()
+    while not request.Test():
+        sleep(0.01)
+    return summary
+
+
+def modified_zscore(values):
+    ''' Robust z-score 0.6745*(x - median)/MAD, which a single slow node
+    cannot hide by inflating the spread and which can exceed any threshold
+    on a handful of nodes. The mean absolute deviation stands in when more
+    than half the values are equal.
+    '''
+    deviation = values - np.median(values)
+    mad = np.median(np.abs(deviation))
+    if mad > 0:
+        return 0.6745*deviation/mad
+    mean_ad = np.mean(np.abs(deviation))
+    return deviation/(1.2533*mean_ad) if mean_ad > 0 else np.zeros_like(values)
+
+
+def screen(gathered, threshold=3.5):
+    ''' Aggregate bandwidth over nodes and per node modified z-scores of
+    every kernel at the highest thread count each node ran
+    '''
+    hostnames = [h for h, _ in gathered]
+    best = [records[-1] for _, records in gathered]
+    rates = {k: np.array([r['kernels'][k]['rate'] for r in best]) for k in KERNELS}
+    zscores = {k: modified_zscore(values) for k, values in rates.items()}
+    outliers = [{'node': h,
+                 'kernels': {k: float(zscores[k][ii]) for k in KERNELS if abs(zscores[k][ii]) > threshold},
+                 'validated': best[ii]['validated']}
+                for ii, h in enumerate(hostnames)
+                if any(abs(zscores[k][ii]) > threshold for k in KERNELS) or not best[ii]['validated']]
+
+    print(f'{len(hostnames)} nodes, aggregate Triad {rates["Triad"].sum():.1f} MB/s,'
+          f' per node median {np.median(rates["Triad"]):.1f} MB/s')
+    print(f'{"node":>20}' + ''.join(f'{k:>12}' for k in KERNELS) + f'{"z Triad":>10}')
+    for ii, h in enumerate(hostnames):
+        print(f'{h:>20}' + ''.join(f'{rates[k][ii]:>12.1f}' for k in KERNELS) + f'{zscores["Triad"][ii]:>10.2f}')
+    for o in outliers:
+        reason = ', '.join(f'{k} z={z:.2f}' for k, z in o['kernels'].items()) or 'failed validation'
+        print(f'Outlier {o["node"]}: {reason}')
+    return {'mode': 'mpi',
+            'nodes': hostnames,
+            'aggregate': {k: float(v.sum()) for k, v in rates.items()},
+            'zscores': {k: [float(z) for z in v] for k, v in zscores.items()},
+            'outliers': outliers,
+            'records': dict(gathered)}
+
+
 if __name__ == '__main__':
     # Parse command line arguments
     parser = ArgumentParser()
@@ -53,10 +413,33 @@ if __name__ == '__main__':
     parser.add_argument('--cc', type=str, default='gcc')
     parser.add_argument('--cflags', type=str, default='-march=native -O3 -fopenmp -ffast-math')
     parser.add_argument('-l3', '--l3', type=str, default=None)
-    parser.add_argument('--no_compile', action='store_true')
+    parser.add_argument('--no_compile', action='store_true', help='Use a manually compiled `stream` binary')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Build cache directory, shared storage lets nodes reuse binaries (default $STREAM_CACHE or ~/.cache)')
+    parser.add_argument('--rebuild', action='store_true', help='Recompile even if a cached binary exists')
     parser.add_argument('-o', '--output', default='results.pickle')
     parser.add_argument('--offset', type=int, default=0)
     parser.add_argument('-r', '--repeats', type=int, default=10)
+    parser.add_argument('--sweep', action='store_true', help='Sweep the working set from inside L1 to beyond L3')
+    parser.add_argument('--threads', type=int, nargs='+', default=None,
+                        help='Thread counts for the sweep, 1 and all cores by default')
+    parser.add_argument('--min_size', type=str, default=None, help='Smallest working set of the sweep, half of one L1 by default')
+    parser.add_argument('--max_size', type=str, default=None, help='Largest working set of the sweep, 4 times L3 by default')
+    parser.add_argument('--points', type=int, default=24, help='Number of log spaced working sets')
+    parser.add_argument('--engine', choices=['c', 'numpy'], default='c',
+                        help='Compiled stream.c, or STREAM in NumPy for nodes without a working compiler')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Compare the NumPy engine against compiled STREAM at each thread count')
+    parser.add_argument('--mpi', action='store_true',
+                        help='Under mpirun, one rank per node runs STREAM concurrently and rank 0 reports outliers')
+    parser.add_argument('--zscore', type=float, default=3.5,
+                        help='Flag nodes whose modified z-score (median and MAD based) is larger than this')
+    parser.add_argument('--numa', action='store_true', help='Bandwidth between every pair of NUMA nodes')
+    parser.add_argument('--affinity', action='store_true', help='Sweep OpenMP binding policies and thread counts')
+    parser.add_argument('--bind', nargs='+', choices=BINDS, default=BINDS, help='OMP_PROC_BIND values to sweep')
+    parser.add_argument('--places', nargs='+', choices=PLACES, default=PLACES, help='OMP_PLACES values to sweep')
+    parser.add_argument('--place_list', nargs='+', default=[],
+                        help='Explicit OMP_PLACES lists to sweep as well, e.g. "{0},{2},{4},{6}"')
     args, _ = parser.parse_known_args()
 
     if args.cores:
@@ -64,53 +447,45 @@ if __name__ == '__main__':
     else:
         cores = guess_cores()
 
-    if args.l3:
-        l3 = size2val(args.l3)
-    else:
-        l3 = guess_l3()
-
-    # L3 cache multiplied by 4, then divided by sizeof(double) = 8
-    array_size = l3//2
-
-    compiler = args.cc
-    cflags = args.cflags
-    pp_defs = f'-DSTREAM_ARRAY_SIZE={array_size} -DNTIMES={args.repeats} -DOFFSET={args.offset}'
-    source_file = Path('stream.c').absolute()
-    executable_file = source_file.with_suffix('')
-
-    compile_command = [compiler] + cflags.split() + pp_defs.split()
-    compile_command += ['-o', str(executable_file)]
-    compile_command.append(str(source_file))
-
-    # ~ print(compile_command)
-    if not args.no_compile:
+    if args.sweep:
         try:
-            run(compile_command, check=True)
-        except CalledProcessError:
-            print('Executing:')
-            print(' '.join(compile_command))
-            print('failed, try compiling manually and pass `--no_compile` argument')
-            print('If running on a system with large L3 cache you may need to add')
-            print('`-mcmodel=medium` or even `-mcmodel=large` to default `--cflags`')
+            caches = guess_caches('ONE-SIZE')
+            totals = guess_caches()
+        except (FileNotFoundError, CalledProcessError):
+            print('Cannot read cache sizes from `lscpu -C`, sweeping from 16KiB and matching knees only against `-l3` if given')
+            caches, totals = {}, {}
+        if args.l3:
+            caches['L3'] = totals['L3'] = size2val(args.l3)
+        if not caches and not (args.min_size and args.max_size):
+            print('Cannot find cache sizes, specify `--min_size` and `--max_size`')
+            exit(1)
+        results = sweep(args, cores, caches, totals)
+    elif args.numa:
+        l3 = size2val(args.l3) if args.l3 else guess_l3()
+        results = numa_sweep(args, build(l3//2, args))
+    elif args.affinity:
+        l3 = size2val(args.l3) if args.l3 else guess_l3()
+        executable_file = build(l3//2, args)
+        if isinstance(executable_file, NumpyStream):
+            # OMP_PROC_BIND and OMP_PLACES mean nothing to a Python thread pool
+            print('OpenMP binding policies do not apply to the NumPy engine, compile stream.c to sweep them')
             exit(1)
+        results = affinity_sweep(args, cores, executable_file)
+    elif args.mpi:
+        results = node_screen(args, cores)
+        if results is None:
+            exit(0)
+    else:
+        if args.l3:
+            l3 = size2val(args.l3)
+        else:
+            l3 = guess_l3()
 
-    run_env = environ.copy()
-    run_env['OMP_DISPLAY_AFFINITY'] = 'TRUE'
-    # ~ run_env['OMP_PLACES'] = 'cores'
-    # ~ run_env['OMP_PROC_BIND'] = 'close'
-    results = []
-    for ii in range(cores):
-        run_env['OMP_NUM_THREADS'] = str(ii + 1)
-        output = run([executable_file], env=run_env, check=True, stdout=PIPE, stderr=PIPE, encoding='UTF-8')
-        for line in output.stdout.split('\n'):
-            # ~ print(line)
-            if line.startswith('level'):
-                print(line)
-            elif line.startswith('Triad'):
-                speed = line.split()[1]
-        results.append(float(speed))
-        print('Cores:', ii + 1, 'Rate:', speed, 'MB/s')
-        print('Affinity:\n', output.stderr)
+        # L3 cache multiplied by 4, then divided by sizeof(double) = 8
+        array_size = l3//2
+        executable_file = build(array_size, args)
+
+        results = thread_scaling(args, cores, executable_file, array_size)
 
     outfile = Path(args.output).absolute()
     with open(outfile, 'wb') as fh:
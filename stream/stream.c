@@ -41,6 +41,7 @@
 /*  5. Absolutely no warranty is expressed or implied.                   */
 /*-----------------------------------------------------------------------*/
 # include <stdio.h>
+# include <stdlib.h>
 # include <unistd.h>
 # include <math.h>
 # include <float.h>
@@ -124,6 +125,17 @@
 #   define OFFSET	0
 #endif
 
+/*  Arrays small enough to sit in cache are swept in well under 20 clock
+ *         ticks. Each timing then covers INNER back to back passes of the
+ *         kernel and reports the time of one pass. Every kernel writes the
+ *         same values on each pass, so validation is unchanged.
+ *      INNER can be set on the compile line, "-DINNER=64", or at run time
+ *         with the STREAM_INNER environment variable.
+ */
+#ifndef INNER
+#   define INNER	1
+#endif
+
 /*
  *	3) Compile the code with optimization.  Many compilers generate
  *       unreasonably bad code before the optimizer tightens things up.  
@@ -203,13 +215,22 @@ extern void tuned_STREAM_Triad(STREAM_TYPE scalar);
 #endif
 #ifdef _OPENMP
 extern int omp_get_num_threads();
+/* OpenMP 5.0, which GCC's runtime provides while _OPENMP still says 4.5,
+ * so take it weakly where the compiler allows */
+#if defined(__GNUC__)
+extern void omp_display_affinity(const char *format) __attribute__((weak));
+#define HAVE_DISPLAY_AFFINITY
+#elif _OPENMP >= 201811
+extern void omp_display_affinity(const char *format);
+#define HAVE_DISPLAY_AFFINITY
+#endif
 #endif
 int
 main()
     {
     int			quantum, checktick();
     int			BytesPerWord;
-    int			k;
+    int			k, r, inner;
     ssize_t		j;
     STREAM_TYPE		scalar;
     double		t, times[4][NTIMES];
@@ -240,6 +261,9 @@ main()
 	(3.0 * BytesPerWord) * ( (double) STREAM_ARRAY_SIZE / 1024.0/1024.),
 	(3.0 * BytesPerWord) * ( (double) STREAM_ARRAY_SIZE / 1024.0/1024./1024.));
     printf("Each kernel will be executed %d times.\n", NTIMES);
+    inner = getenv("STREAM_INNER") ? atoi(getenv("STREAM_INNER")) : INNER;
+    inner = inner > 0 ? inner : 1;
+    printf("Each timing covers %d passes over the arrays.\n", inner);
     printf(" The *best* time for each kernel (excluding the first iteration)\n"); 
     printf(" will be used to compute the reported bandwidth.\n");
 
@@ -251,6 +275,13 @@ main()
 	{
 	    k = omp_get_num_threads();
 	    printf ("Number of Threads requested = %i\n",k);
+#ifdef HAVE_DISPLAY_AFFINITY
+	    /* OMP_DISPLAY_AFFINITY reports the threads a team starts, so a
+	     * team of one has no report unless the master gives its own */
+	    if (k == 1 && omp_display_affinity && getenv("OMP_DISPLAY_AFFINITY")
+		&& (getenv("OMP_DISPLAY_AFFINITY")[0] == 't' || getenv("OMP_DISPLAY_AFFINITY")[0] == 'T'))
+		omp_display_affinity(NULL);
+#endif
         }
     }
 #endif
@@ -308,43 +339,55 @@ main()
 	{
 	times[0][k] = mysecond();
 #ifdef TUNED
+	for (r=0; r<inner; r++)
         tuned_STREAM_Copy();
 #else
-#pragma omp parallel for
+#pragma omp parallel private(r)
+	for (r=0; r<inner; r++)
+#pragma omp for
 	for (j=0; j<STREAM_ARRAY_SIZE; j++)
 	    c[j] = a[j];
 #endif
-	times[0][k] = mysecond() - times[0][k];
+	times[0][k] = (mysecond() - times[0][k])/inner;
 	
 	times[1][k] = mysecond();
 #ifdef TUNED
+	for (r=0; r<inner; r++)
         tuned_STREAM_Scale(scalar);
 #else
-#pragma omp parallel for
+#pragma omp parallel private(r)
+	for (r=0; r<inner; r++)
+#pragma omp for
 	for (j=0; j<STREAM_ARRAY_SIZE; j++)
 	    b[j] = scalar*c[j];
 #endif
-	times[1][k] = mysecond() - times[1][k];
+	times[1][k] = (mysecond() - times[1][k])/inner;
 	
 	times[2][k] = mysecond();
 #ifdef TUNED
+	for (r=0; r<inner; r++)
         tuned_STREAM_Add();
 #else
-#pragma omp parallel for
+#pragma omp parallel private(r)
+	for (r=0; r<inner; r++)
+#pragma omp for
 	for (j=0; j<STREAM_ARRAY_SIZE; j++)
 	    c[j] = a[j]+b[j];
 #endif
-	times[2][k] = mysecond() - times[2][k];
+	times[2][k] = (mysecond() - times[2][k])/inner;
 	
 	times[3][k] = mysecond();
 #ifdef TUNED
+	for (r=0; r<inner; r++)
         tuned_STREAM_Triad(scalar);
 #else
-#pragma omp parallel for
+#pragma omp parallel private(r)
+	for (r=0; r<inner; r++)
+#pragma omp for
 	for (j=0; j<STREAM_ARRAY_SIZE; j++)
 	    a[j] = b[j]+scalar*c[j];
 #endif
-	times[3][k] = mysecond() - times[3][k];
+	times[3][k] = (mysecond() - times[3][k])/inner;
 	}
 
     /*	--- SUMMARY --- */
@@ -0,0 +1,109 @@
+import numpy as np
+
+# STREAM_TYPE is double and there are three arrays
+BYTES_PER_ELEMENT = 3*8
+# Bytes per element STREAM credits each kernel with
+KERNEL_BYTES = {'Copy': 2*8, 'Scale': 2*8, 'Add': 3*8, 'Triad': 3*8}
+
+
+def working_sets(smallest, largest, count):
+    ''' Log spaced total working sets in bytes, with the STREAM_ARRAY_SIZE
+    giving each one
+    '''
+    sizes = np.unique(np.geomspace(smallest, largest, count).round()//BYTES_PER_ELEMENT)
+    sizes = sizes[sizes > 0].astype(int)
+    return [int(s*BYTES_PER_ELEMENT) for s in sizes], [int(s) for s in sizes]
+
+
+def inner_passes(working_set, threads, target=2**24):
+    ''' Passes over the arrays per timing so each thread moves about
+    `target` bytes, which takes over 20 ticks of a microsecond clock even at
+    L1 bandwidth
+    '''
+    return max(1, -(-target*threads//working_set))
+
+
+def reliable(record, ticks=20):
+    ''' STREAM's own rule of thumb, each timing needs to cover at least
+    20 clock ticks for its best time to mean anything. The printed times
+    round to a microsecond, so the time of a pass comes from the rate.
+    '''
+    granularity = record.get('granularity', 1e-6)
+    inner = record.get('inner', 1)
+    if 'array_size' in record:
+        best = min(KERNEL_BYTES[k]*record['array_size']/(1e6*v['rate']) for k, v in record['kernels'].items())
+    else:
+        best = min(v['min'] for v in record['kernels'].values())
+    return inner*best >= ticks*granularity
+
+
+def plateaus(working_set, rates, max_levels=4, min_points=2, penalty=None):
+    ''' Split a bandwidth against working set curve into flat levels.
+
+    The log of the rate is fitted by piecewise constant segments of at
+    least `min_points` points. Dynamic programming finds the best split for
+    each number of segments, and a BIC style n*log(SSE/n) + penalty*levels
+    criterion chooses how many. A knee is where one level gives way to the
+    next, placed geometrically between the last point of one level and the
+    first of the next.
+    '''
+    x = np.asarray(working_set, dtype=float)
+    y = np.log(np.asarray(rates, dtype=float))
+    n = len(y)
+    if penalty is None:
+        penalty = 2*np.log(n)
+    max_levels = max(1, min(max_levels, n//min_points))
+
+    # Sum of squared error of every segment y[i:j] from prefix sums
+    s1 = np.r_[0, np.cumsum(y)]
+    s2 = np.r_[0, np.cumsum(y**2)]
+    i, j = np.triu_indices(n + 1, k=min_points)
+    cost = np.full((n + 1, n + 1), np.inf)
+    cost[i, j] = s2[j] - s2[i] - (s1[j] - s1[i])**2/(j - i)
+
+    best = np.full((max_levels + 1, n + 1), np.inf)
+    best[0, 0] = 0
+    split = np.zeros((max_levels + 1, n + 1), dtype=int)
+    for k in range(1, max_levels + 1):
+        candidates = best[k - 1][:, None] + cost
+        split[k] = np.argmin(candidates, axis=0)
+        best[k] = candidates[split[k], np.arange(n + 1)]
+
+    with np.errstate(divide='ignore'):
+        score = [n*np.log(max(best[k, n], 1e-300)/n) + penalty*k for k in range(1, max_levels + 1)]
+    k = int(np.argmin(score)) + 1
+
+    bounds = [n]
+    for kk in range(k, 0, -1):
+        bounds.append(split[kk, bounds[-1]])
+    bounds = bounds[::-1]
+
+    levels = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        levels.append({'smallest': float(x[lo]),
+                       'largest': float(x[hi - 1]),
+                       'rate': float(np.exp(np.median(y[lo:hi])))})
+    knees = [float(np.sqrt(x[b - 1]*x[b])) for b in bounds[1:-1]]
+    return {'levels': levels, 'knees': knees}
+
+
+def cache_reach(one, total, threads, cores):
+    ''' Capacity of each cache level usable by `threads` threads packed on
+    `cores` cores. Private caches give one instance per thread, shared ones
+    count once for all the threads on them, and never more than every
+    instance.
+    '''
+    reach = {}
+    for name, size in one.items():
+        instances = max(1, total.get(name, size)//size)
+        used = min(instances, -(-threads*instances//max(cores, 1)))
+        reach[name] = size*used
+    return reach
+
+
+def nearest_cache(knee, caches):
+    ''' Cache level whose capacity is closest (on a log scale) to a knee
+    '''
+    if not caches:
+        return None
+    return min(caches, key=lambda name: abs(np.log(knee/caches[name])))